@@ -9,16 +9,21 @@
 # You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 
-from sys import platform
+from sys import platform, path as sys_path
 from os import system, path, chdir, getcwd, getenv, remove, _exit, mkdir
 from requests import request
 from random import randint
+from secrets import token_hex
 from json import dumps, load
 import urllib3
-import threading
 import requests
 import time
-from inspect import currentframe, getframeinfo
+
+LAN_SERVER_PATH = path.join(path.dirname(path.abspath(__file__)), "lan_server")
+if LAN_SERVER_PATH not in sys_path:
+    sys_path.insert(0, LAN_SERVER_PATH)
+
+from discovery import probe
 
 urllib3.disable_warnings()
 
@@ -38,6 +43,8 @@ class Driver:
         self.log(("Loop connection enabled",))
 
         self.code = str(randint(0, 9999999))
+        self.key = token_hex(16)  # signs the discovery probes and the datagrams, sent to the Pi over TLS
+        self.previous_key = None  # key of the last session, the Pi still knows it and answers discovery probes signed with it
         self.ip = ''
         self.port = 9876
 
@@ -70,8 +77,11 @@ class Driver:
 
         if path.isfile(self.config_file_path):
             pi_ip = open(self.config_file_path, 'r')
-            self.ip = load(pi_ip)["ip"]
+            saved = load(pi_ip)
             pi_ip.close()
+            self.ip = saved["ip"]
+            if saved.get("key") != self.key:  # load_config can be called twice
+                self.previous_key = saved.get("key")
         else:
             if self.platform == "linux":
                 self.ip = input("Input Piʼs IP address (temporary): ")
@@ -87,8 +97,29 @@ class Driver:
                     print("Aborting process.")
                     _exit(1)
 
+        self.save_config()
+
+    def save_config(self):
         with open(self.config_file_path, 'w') as pi_ip:
-            pi_ip.write(dumps({"ip": self.ip, "code": self.code}))
+            pi_ip.write(dumps({"ip": self.ip, "code": self.code, "key": self.key}))
+
+    def discover_pi(self):
+        """
+        Look for the Pi on the LAN with the key of the last session.
+
+        :return: True if the Pi was found at a new address.
+        """
+        if not self.previous_key:
+            return False
+
+        ip = probe(self.previous_key, "driver")
+        if ip is None or ip == self.ip:
+            return False
+
+        print(f"Pi found at {ip}")
+        self.ip = ip
+        self.save_config()
+        return True
 
     def new_ip(self):
         if self.platform == "linux":
@@ -107,8 +138,7 @@ class Driver:
                 print("Aborting process.")
                 _exit(1)
 
-        with open(self.config_file_path, 'w') as pi_ip:
-            pi_ip.write(dumps({"ip": self.ip, "code": self.code}))
+        self.save_config()
 
         return_to_est = self.establish_connection()
 
@@ -121,19 +151,20 @@ class Driver:
         :return:
         """
 
-        url = f"https://{self.ip}:{self.port}/connect"
-        content = {"code": self.code, "platform": platform}
+        content = {"code": self.code, "key": self.key, "platform": platform}
         headers = {"Content-Type": "application/json"}
         content = dumps(content)
 
         if not self.loop_connection:
             for tries in range(10):
                 try:
+                    url = f"https://{self.ip}:{self.port}/connect"
                     connection = request('POST', url, data=content, headers=headers, verify=False)
                     return connection.text == "True"
                 except requests.exceptions.ConnectionError:
                     print(f"Connection to Pi failed [{tries+1}/10]")
-                    time.sleep(1)
+                    if not self.discover_pi():  # the discovery waits about a second
+                        time.sleep(1)
 
             print("The driver is unable to connect to your Pi.")
             print("Please verify that Pi is running his software and hasn't encountered any error.")
@@ -150,52 +181,40 @@ class Driver:
         else:
             while True:
                 try:
+                    url = f"https://{self.ip}:{self.port}/connect"
                     connection = request('POST', url, data=content, headers=headers, verify=False)
                     return connection.text == "True"
                 except requests.exceptions.ConnectionError:
                     print(f"Connection to Pi failed, retrying...")
-
-    def watchdog(self):
-        time.sleep(2)
-        address = "https://localhost:"+str(self.port)
-        while True:
-            try:
-                requests.post(address)
-                time.sleep(3)
-            except Exception:
-                break
-
-        print("Restarting driver server")
-        self.run()
-        return
+                    self.discover_pi()
 
     def run(self):
         """
         This make the driver listen to post request from the Raspberry Pi and process it.
+        The LAN server runs in this process and is started again if it stops.
 
         :return:
         """
-        watchdog = threading.Thread(name="Server Watchdog", target=self.watchdog)
-
-        chdir(path.join(self.driver_path, "lan_server"))
-
-        if self.platform == "win32":
-            if self.verbose:
-                frameinfo = getframeinfo(currentframe())
-                current_line = frameinfo.lineno + 3
-                print(f"\nYou are currently running RaspiMote in verbose mode. Consequently, your local installation of Python (which must be accessible by calling \"python\") will be used instead of the embeddable version. Ensure that the modules \"Flask\" and \"Flask-Cors\", along with \"https\", our fork of \"Cheroot\" are installed on your local installation. You can find more informations on \"https://docs.raspimote.tk/\". If you desire to change this behavior, you can edit the line {current_line} of \"{frameinfo.filename}\".\n")
-                system(f'python wsgi_https.py -v')
+        if self.platform not in ("win32", "linux"):
+            if self.platform == "darwin":
+                print("System not supported for the moment.")
             else:
-                system(f'"C:\\Program Files\\RaspiMote\\py\\pythonw.exe" wsgi_https.py')
+                print("System not supported.")
+            return
 
-        elif self.platform == "linux":
-            vb_arg = ['', ' -v'][int(self.verbose)]
-            system(f'/usr/bin/python3 wsgi_https.py{vb_arg}')
+        chdir(LAN_SERVER_PATH)  # certificate, UI and custom functions are found from there
 
-        elif self.platform == "darwin":
-            print("System not supported for the moment.")
+        import wsgi_https
 
-        else:
-            print("System not supported.")
+        while True:
+            try:
+                wsgi_https.serve()
+                break
+            except KeyboardInterrupt:
+                wsgi_https.stop()
+                break
+            except Exception as error:
+                print(f"Driver server stopped : {error}")
 
-        watchdog.start()
+            print("Restarting driver server")
+            time.sleep(1)
@@ -0,0 +1,117 @@
+"""
+Files of the configuration UI, loaded once in memory with their compressed versions.
+
+The page and the stylesheets refer to the other files with their ETag in the URL (style.css?v=<etag>),
+those URLs change with the content so they are cached for a year, the page itself is always revalidated.
+"""
+import gzip
+import re
+from hashlib import sha256
+from mimetypes import guess_type
+from os import path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UI_FOLDER = path.join(path.dirname(path.abspath(__file__)), "ui")
+
+# URL -> file in the ui folder
+ASSETS = {
+    "": "ui_model.html",
+    "style.css": "style.css",
+    "initElements.js": "js/initElements.js",
+    "showHide.js": "js/showHide.js",
+    "showHideButton.js": "js/showHideButton.js",
+    "showHideADC.js": "js/showHideADC.js",
+    "showHideKeyboard.js": "js/showHideKeyboard.js",
+    "showHideGamepad.js": "js/showHideGamepad.js",
+    "saveButton.js": "js/saveButton.js",
+    "saveADC.js": "js/saveADC.js",
+    "saveKeyboard.js": "js/saveKeyboard.js",
+    "saveGamepad.js": "js/saveGamepad.js",
+    "jquery.js": "js/jquery-3.6.0.min.js",
+    "sweetalert.js": "js/sweetalert2.all.min.js",
+    "sweetalert.css": "js/sweetalert2.borderless.min.css",
+    "RaspiMote_logo.ico": "RaspiMote_logo.ico",
+    "RaspiMote_logo_500px.png": "RaspiMote_logo_500px.png",
+    "loading.gif": "loading.gif",
+    "xbox_one.png": "xbox_one.png",
+}
+
+COMPRESSED_TYPES = ("text/", "application/javascript", "image/vnd.microsoft.icon", "image/x-icon")
+
+IMMUTABLE = "public, max-age=31536000, immutable"  # URL with the current ETag
+REVALIDATE = "no-cache"  # the page, and URLs without version : an unchanged file costs a 304 answer to the ETag
+
+# src="...", href="..." and url(...) references in the page and the stylesheets
+REFERENCE = re.compile(r'''((?:src|href)=["']|url\(["']?)([^"')?]+)''')
+
+
+class Asset:
+    def __init__(self, file):
+        with open(path.join(UI_FOLDER, file), "rb") as asset:
+            body = asset.read()
+
+        mimetype = guess_type(file)[0] or "application/octet-stream"
+        if mimetype in ("text/javascript", "application/x-javascript"):
+            mimetype = "application/javascript"
+        self.mimetype = mimetype
+        self.set_body(body)
+
+    def set_body(self, body):
+        self.body = body
+        self.etag = sha256(self.body).hexdigest()[:32]
+
+        self.encodings = {}
+        if self.mimetype.startswith(COMPRESSED_TYPES):
+            if brotli is not None:
+                self.add_encoding("br", brotli.compress(self.body, quality=11))
+            self.add_encoding("gzip", gzip.compress(self.body, compresslevel=9, mtime=0))
+
+    def add_encoding(self, encoding, body):
+        if len(body) < len(self.body):
+            self.encodings[encoding] = body
+
+    def cache_control(self, version):
+        """
+        :param version: v parameter of the request's URL.
+        """
+        if self.mimetype != "text/html" and version == self.etag:
+            return IMMUTABLE
+        return REVALIDATE
+
+    def select(self, accept_encoding):
+        """
+        :param accept_encoding: Accept-Encoding header of the request.
+        :return: (encoding or None, body)
+        """
+        accepted = {value.split(";")[0].strip() for value in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and encoding in accepted:
+                return encoding, self.encodings[encoding]
+        return None, self.body
+
+
+def add_versions(asset, assets):
+    """
+    Add the ETag of the files referred to by this page or stylesheet to their URLs.
+    """
+    def versioned(match):
+        target = assets.get(match.group(2))
+        if target is None:
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}?v={target.etag}"
+
+    body = REFERENCE.sub(versioned, asset.body.decode("utf-8"))
+    asset.set_body(body.encode("utf-8"))
+
+
+def load_assets():
+    assets = {url: Asset(file) for url, file in ASSETS.items()}
+    for mimetype in ("text/css", "text/html"):  # stylesheets first, their ETag changes with the URLs they refer to
+        for asset in assets.values():
+            if asset.mimetype == mimetype:
+                add_versions(asset, assets)
+    return assets
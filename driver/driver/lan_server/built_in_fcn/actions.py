@@ -2,7 +2,9 @@
 
 from os import system, getenv
 from sys import platform, path
-from keyboard import send as press, write
+from threading import local, Lock, Timer
+from time import sleep
+from built_in_fcn.injection import get_backend
 if platform == "win32":
     appdata = getenv("APPDATA")
     path.insert(1, f"{appdata}\\RaspiMote\\custom_fcn")
@@ -14,128 +16,156 @@ elif platform == "linux":
 
 
 
-def press_key(action, value):
+# Keystrokes of the built-in actions are gathered during one dispatch (key_batch) and, if key_window is set,
+# during key_window seconds, then sent to the injection backend in as few calls as possible.
+# User code (custom functions, parse_data) runs in keys_unbatched : its keystrokes are sent at once,
+# so the order and the delays between keys, commands and sleep() calls are kept.
+key_window = 0
+batches = local()
+pending = []
+pending_lock = Lock()
+flush_lock = Lock()
+flush_timer = None
+
+
+def set_key_window(seconds):
+    """
+    :param seconds: time during which keystrokes are gathered before being sent, 0 to send them at the end of each dispatch.
+    """
+    global key_window
+    key_window = seconds
+
+
+class key_batch:
+    """
+    Gather the keystrokes of the actions run in this block and send them when it ends.
+    """
+    def __enter__(self):
+        batches.depth = getattr(batches, "depth", 0) + 1
+        if batches.depth == 1:
+            batches.operations = []
+        return self
+
+    def __exit__(self, *exception):
+        batches.depth -= 1
+        if batches.depth == 0:
+            operations = batches.operations
+            batches.operations = None
+            if operations:
+                queue_operations(operations)
+
+
+class keys_unbatched:
+    """
+    Send the keystrokes gathered so far, then send every keystroke of this block as soon as it is queued.
+    """
+    def __enter__(self):
+        flush_keys()
+        self.operations = getattr(batches, "operations", None)
+        self.direct = getattr(batches, "direct", False)
+        batches.operations = None
+        batches.direct = True
+        return self
+
+    def __exit__(self, *exception):
+        batches.operations = self.operations
+        batches.direct = self.direct
+
+
+def flush_keys():
+    """
+    Send the pending keystrokes now, so they happen before what comes next.
+    """
+    with pending_lock:
+        waiting = bool(pending)
+    if waiting:
+        flush_pending()
+
+    operations = getattr(batches, "operations", None)
+    if operations:
+        batches.operations = []
+        with flush_lock:
+            run_operations(operations)
+
+
+def queue_operations(operations):
+    global flush_timer
+
+    current = getattr(batches, "operations", None)
+    if current is not None:
+        current.extend(operations)
+
+    elif getattr(batches, "direct", False):
+        flush_keys()
+        with flush_lock:
+            run_operations(operations)
+
+    elif key_window > 0:
+        with pending_lock:
+            pending.extend(operations)
+            if flush_timer is None:
+                flush_timer = Timer(key_window, flush_pending)
+                flush_timer.daemon = True
+                flush_timer.start()
+
+    else:
+        with flush_lock:
+            run_operations(operations)
+
+
+def flush_pending():
+    global flush_timer
+
+    with flush_lock:
+        with pending_lock:
+            operations = pending[:]
+            pending.clear()
+            flush_timer = None
+        run_operations(operations)
+
+
+def run_operations(operations):
+    """
+    :param operations: list of ("key", key, delay after the key) and ("type", text), in order.
+    """
+    backend = get_backend()
+    index = 0
+    while index < len(operations):
+        if operations[index][0] == "type":
+            text = ""
+            while index < len(operations) and operations[index][0] == "type":
+                text += operations[index][1]
+                index += 1
+            backend.type_text(text)
+            continue
+
+        delay = operations[index][2]
+        keys = []
+        while index < len(operations) and operations[index][0] == "key" and operations[index][2] == delay:
+            keys.append(operations[index][1])
+            index += 1
+        backend.press(keys, delay)
+
+        if delay and index < len(operations):
+            sleep(delay)
+
+
+def press_key(action, value, delay=0):
     """
     Do the specified action or simulate keystroke.
     action : "alphabet" or "numeral" for keypress simulation or "media" for other (see list)
 
-    :param action: alphabet, numeral or media
+    :param action: alphabet, numeral, fn, media or other
     :param value: see allowed value in documentation
+    :param delay: time in seconds to wait before the next keystroke
     :return:
     """
-    if action == "alphabet" or action == 'numeral':
-        if platform == 'linux':
-            system(f"xdotool key {value}")
-
-        elif platform == 'win32':
-            press(value)
-
-        else:
-            print("Not implemented.")
-
-    elif action == "media":
-        if platform == 'linux':
-
-            if value == "volup":  
-                system('xdotool key XF86AudioRaiseVolume')
-            elif value == "voldown":
-                system('dotool key XF86AudioLowerVolume')
-            elif value ==  "mute":
-                system('xdotool key XF86AudioMute')
-            elif value == "pp":
-                system('xdotool key XF86AudioPlay')
-            elif value == "next":
-                system('xdotool key XF86AudioNext')
-            elif value == "previous":
-                system('xdotool key XF86AudioPrev')
-
-        elif platform == 'win32':
-
-            if value == "volup":  
-                press('volume up')
-            elif value == "voldown":
-                press('volume down')
-            elif value ==  "mute":
-                press('volume mute')
-            elif value == "pp":
-                press('play/pause media')
-            elif value == "next":
-                press('next track')
-            elif value == "previous":
-                press('previous track')
-
-        else:
-            print('Not implemented.')
-
-    elif action == "fn":
-        if platform == 'linux':           
-            system(f'xdotool key {value.upper()}')
-
-        if platform == 'win32':
-            press(f'{value}')
-
-        else:
-            print('Not implemented.')
-
-    elif action == "other":
-        if platform == "linux":
-            if value == "psc":
-                system('xdotool key Print')
-            elif value == "pos1":
-                system('xdotool key Home')
-            elif value == "end":
-                system('xdotool key End')
-            elif value == "del":
-                system('xdotool key Delete')
-            elif value == "enter":
-                system('xdotool key Return')
-            elif value == "backspace":
-                system('xdotool key BackSpace')
-            elif value == "tab":
-                system('xdotool key Tab')
-            elif value == "pup":
-                system('xdotool key Page_Up')
-            elif value == "pdown":
-                press('xdotool key Page_Down')
-            elif value == "shift":
-                system('xdotool key Shift_L')
-            elif value == "ctrl":
-                system('xdotool key Control_L')
-            elif value == "alt":
-                system('xdotool key Alt_L')
-            elif value == "super":
-                system('xdotool key Super_L')
-
-        elif platform == 'win32':
-            if value == "psc":
-                press('print screen')
-            elif value == "pos1":
-                press('home')
-            elif value == "end":
-                press('end')
-            elif value == "del":
-                press('delete')
-            elif value == "enter":
-                press('enter')
-            elif value == "backspace":
-                press('backspace')
-            elif value == "tab":
-                press('tab')
-            elif value == "pup":
-                press('page up')
-            elif value == "pdown":
-                press('page down')
-            elif value == "shift":
-                press('shift')
-            elif value == "ctrl":
-                press('ctrl')
-            elif value == "alt":
-                press('alt')
-            elif value == "super":
-                press('left windows')
-
-        else:
-            print('Not implemented.')
+    if action not in ("alphabet", "numeral", "fn", "media", "other"):
+        print(f"Unknown key category : {action}")
+        return
+
+    queue_operations([("key", value, delay)])
+
 
 def type_text(text):
     """
@@ -144,11 +174,7 @@ def type_text(text):
     :param text: A string
     :return:
     """
-    if platform == 'linux':
-        system(f'xdotool type "{text}"')
-
-    if platform == 'win32':
-        write(text)
+    queue_operations([("type", text)])
 
 
 def send_notification(title, text):
@@ -160,6 +186,7 @@ def send_notification(title, text):
     :return:
     """
 
+    flush_keys()
     if platform == 'linux':
         system(f"notify-send -a {title} -i RaspiMote -t 5000 '{text}'")
 
@@ -178,6 +205,7 @@ def battery_level(level):
 
 
 def change_volume(level):
+    flush_keys()
     if platform == 'linux':
         system(f"amixer set Master {level}%")
 
@@ -186,4 +214,5 @@ def change_volume(level):
         system(f"nircmd.exe setsysvolume {level}")
 
 def run_command(command):
+    flush_keys()
     system(command)
\ No newline at end of file
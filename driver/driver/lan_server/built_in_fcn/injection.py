@@ -0,0 +1,246 @@
+# 2021 RaspiMote
+# https://github.com/A-delta
+# -*- coding: utf-8 -*-
+"""
+Long-lived backends simulating keystrokes, so a key press doesn't start a new process.
+
+    xdotool  : one "xdotool -" process reading commands on its standard input (Linux, X11)
+    uinput   : virtual keyboard created with python-evdev (Linux, X11 and Wayland, needs access to /dev/uinput)
+    keyboard : keyboard library (Windows)
+    recording: keeps the keystrokes in a list, for tests
+"""
+import subprocess
+from sys import platform
+from threading import Lock
+from time import sleep
+
+# Key names used by the configuration UI -> name for each backend
+KEYS = {
+    # media
+    "volup":     {"xdotool": "XF86AudioRaiseVolume", "keyboard": "volume up",        "uinput": "KEY_VOLUMEUP"},
+    "voldown":   {"xdotool": "XF86AudioLowerVolume", "keyboard": "volume down",      "uinput": "KEY_VOLUMEDOWN"},
+    "mute":      {"xdotool": "XF86AudioMute",        "keyboard": "volume mute",      "uinput": "KEY_MUTE"},
+    "pp":        {"xdotool": "XF86AudioPlay",        "keyboard": "play/pause media", "uinput": "KEY_PLAYPAUSE"},
+    "next":      {"xdotool": "XF86AudioNext",        "keyboard": "next track",       "uinput": "KEY_NEXTSONG"},
+    "previous":  {"xdotool": "XF86AudioPrev",        "keyboard": "previous track",   "uinput": "KEY_PREVIOUSSONG"},
+    # other
+    "psc":       {"xdotool": "Print",     "keyboard": "print screen", "uinput": "KEY_SYSRQ"},
+    "pos1":      {"xdotool": "Home",      "keyboard": "home",         "uinput": "KEY_HOME"},
+    "end":       {"xdotool": "End",       "keyboard": "end",          "uinput": "KEY_END"},
+    "del":       {"xdotool": "Delete",    "keyboard": "delete",       "uinput": "KEY_DELETE"},
+    "enter":     {"xdotool": "Return",    "keyboard": "enter",        "uinput": "KEY_ENTER"},
+    "backspace": {"xdotool": "BackSpace", "keyboard": "backspace",    "uinput": "KEY_BACKSPACE"},
+    "tab":       {"xdotool": "Tab",       "keyboard": "tab",          "uinput": "KEY_TAB"},
+    "pup":       {"xdotool": "Page_Up",   "keyboard": "page up",      "uinput": "KEY_PAGEUP"},
+    "pdown":     {"xdotool": "Page_Down", "keyboard": "page down",    "uinput": "KEY_PAGEDOWN"},
+    "shift":     {"xdotool": "Shift_L",   "keyboard": "shift",        "uinput": "KEY_LEFTSHIFT"},
+    "ctrl":      {"xdotool": "Control_L", "keyboard": "ctrl",         "uinput": "KEY_LEFTCTRL"},
+    "alt":       {"xdotool": "Alt_L",     "keyboard": "alt",          "uinput": "KEY_LEFTALT"},
+    "super":     {"xdotool": "Super_L",   "keyboard": "left windows", "uinput": "KEY_LEFTMETA"},
+}
+
+# Characters typed by the uinput backend : character -> (key, shift)
+UINPUT_CHARACTERS = {" ": ("KEY_SPACE", False), "\n": ("KEY_ENTER", False), "\t": ("KEY_TAB", False),
+                     "-": ("KEY_MINUS", False), "_": ("KEY_MINUS", True), "=": ("KEY_EQUAL", False), "+": ("KEY_EQUAL", True),
+                     ".": ("KEY_DOT", False), ">": ("KEY_DOT", True), ",": ("KEY_COMMA", False), "<": ("KEY_COMMA", True),
+                     "/": ("KEY_SLASH", False), "?": ("KEY_SLASH", True), ";": ("KEY_SEMICOLON", False), ":": ("KEY_SEMICOLON", True),
+                     "'": ("KEY_APOSTROPHE", False), '"': ("KEY_APOSTROPHE", True), "!": ("KEY_1", True), "@": ("KEY_2", True),
+                     "#": ("KEY_3", True), "$": ("KEY_4", True), "%": ("KEY_5", True), "^": ("KEY_6", True), "&": ("KEY_7", True),
+                     "*": ("KEY_8", True), "(": ("KEY_9", True), ")": ("KEY_0", True)}
+
+
+class InjectionBackend:
+    name = None
+
+    def key_name(self, key):
+        """
+        :param key: name used by the configuration UI ("q", "5", "f5", "volup", ...)
+        :return: name of the key for this backend.
+        """
+        names = KEYS.get(key)
+        if names is not None:
+            return names[self.name]
+        return key
+
+    def press(self, keys, delay=0):
+        """
+        Press and release keys one after the other.
+
+        :param keys: list of names used by the configuration UI.
+        :param delay: time in seconds between two keys.
+        """
+        raise NotImplementedError
+
+    def type_text(self, text):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class XdotoolBackend(InjectionBackend):
+    name = "xdotool"
+
+    def __init__(self):
+        self.process = None
+        self.lock = Lock()
+
+    def key_name(self, key):
+        if key not in KEYS and key[:1] == "f" and key[1:].isdigit():
+            return key.upper()
+        return super().key_name(key)
+
+    def start(self):
+        self.process = subprocess.Popen(["xdotool", "-"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+
+    def run(self, command):
+        with self.lock:
+            for attempt in range(2):
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                try:
+                    self.process.stdin.write(command + "\n")
+                    self.process.stdin.flush()
+                    return
+                except (BrokenPipeError, OSError):
+                    self.process = None  # xdotool exited, started again once
+            print(f"xdotool command not sent : {command}")
+
+    def press(self, keys, delay=0):
+        self.run(f"key --delay {round(delay * 1000)} " + " ".join(self.key_name(key) for key in keys))
+
+    def type_text(self, text):
+        for index, line in enumerate(text.split("\n")):
+            if index:
+                self.run("key Return")
+            if line:
+                line = line.replace("\\", "\\\\").replace('"', '\\"')
+                self.run(f'type "{line}"')
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process = None
+
+
+class UinputBackend(InjectionBackend):
+    name = "uinput"
+
+    def __init__(self):
+        from evdev import UInput, ecodes
+
+        self.ecodes = ecodes
+        self.device = UInput(name="RaspiMote virtual keyboard")
+        self.lock = Lock()
+
+    def key_name(self, key):
+        if key not in KEYS:
+            return f"KEY_{key.upper()}"
+        return super().key_name(key)
+
+    def tap(self, code, shift=False):
+        ecodes = self.ecodes
+        if shift:
+            self.device.write(ecodes.EV_KEY, ecodes.KEY_LEFTSHIFT, 1)
+        self.device.write(ecodes.EV_KEY, code, 1)
+        self.device.write(ecodes.EV_KEY, code, 0)
+        if shift:
+            self.device.write(ecodes.EV_KEY, ecodes.KEY_LEFTSHIFT, 0)
+        self.device.syn()
+
+    def press(self, keys, delay=0):
+        with self.lock:
+            for index, key in enumerate(keys):
+                if index and delay:
+                    sleep(delay)
+                code = getattr(self.ecodes, self.key_name(key), None)
+                if code is None:
+                    print(f"Key not available with uinput : {key}")
+                    continue
+                self.tap(code)
+
+    def type_text(self, text):
+        with self.lock:
+            for character in text:
+                if character in UINPUT_CHARACTERS:
+                    name, shift = UINPUT_CHARACTERS[character]
+                elif character.isascii() and character.isalnum():
+                    name, shift = f"KEY_{character.upper()}", character.isupper()
+                else:
+                    print(f"Character not available with uinput : {character}")
+                    continue
+                self.tap(getattr(self.ecodes, name), shift)
+
+    def close(self):
+        self.device.close()
+
+
+class KeyboardBackend(InjectionBackend):
+    name = "keyboard"
+
+    def __init__(self):
+        import keyboard
+
+        self.keyboard = keyboard
+
+    def press(self, keys, delay=0):
+        for index, key in enumerate(keys):
+            if index and delay:
+                sleep(delay)
+            self.keyboard.send(self.key_name(key))
+
+    def type_text(self, text):
+        self.keyboard.write(text)
+
+
+class RecordingBackend(InjectionBackend):
+    name = "recording"
+
+    def __init__(self):
+        self.calls = []
+
+    def press(self, keys, delay=0):
+        self.calls.append(("press", list(keys), delay))
+
+    def type_text(self, text):
+        self.calls.append(("type", text))
+
+
+BACKENDS = {"xdotool": XdotoolBackend, "uinput": UinputBackend, "keyboard": KeyboardBackend, "recording": RecordingBackend}
+
+backend = None
+backend_lock = Lock()
+
+
+def set_backend(new_backend):
+    """
+    :param new_backend: name in BACKENDS or InjectionBackend instance.
+    """
+    global backend
+
+    if type(new_backend) == str:
+        if new_backend not in BACKENDS:
+            raise Exception(f"Unknown injection backend : {new_backend}")
+        new_backend = BACKENDS[new_backend]()
+
+    with backend_lock:
+        if backend is not None:
+            backend.close()
+        backend = new_backend
+
+
+def get_backend():
+    global backend
+
+    with backend_lock:
+        if backend is None:
+            if platform == "win32":
+                backend = KeyboardBackend()
+            elif platform == "linux":
+                backend = XdotoolBackend()
+            else:
+                raise Exception("No injection backend for this platform.")
+        return backend
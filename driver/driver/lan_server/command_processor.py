@@ -9,17 +9,42 @@
 # You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-from built_in_fcn.actions import type_text, run_command, press_key
+from built_in_fcn.actions import type_text, run_command, press_key, key_batch, keys_unbatched
 from os import getenv, path
 from sys import platform
 from json import dumps
+from time import time
+
+from latency import LatencyTracker
+from rules import RuleEngine
+from defs import ConfigStore
+
+if platform == "linux":
+    config_folder = f"{getenv('HOME')}/.config/RaspiMote"
+elif platform == "win32":
+    config_folder = f"{getenv('APPDATA')}\\RaspiMote"
+elif platform == "darwin": # EXPERIMENTAL
+    config_folder = f"{getenv('HOME')}/Library/Application Support/RaspiMote"
+
+latency = LatencyTracker()
+store = ConfigStore(path.join(config_folder, "trigger_actions.raspimote"))
+rules = RuleEngine(store)
 
 
 def process(json):
+    """
+    :param json: {"code": ..., "request": ..., "received": time when the driver received it (optional)}
+    """
     if json["request"]["type"] in "inventory":
         makeInventory(json)
     else:
-        parse_data(json)
+        dispatched = time()
+        with key_batch():  # keystrokes of one event are sent in one call
+            matched = rules.dispatch(json["request"])
+        if not matched:
+            with keys_unbatched():  # user code may sleep between two keys
+                parse_data(json)
+        latency.trace(json["request"], json.get("received"), dispatched, time())
 
 
 def makeInventory(json):
@@ -36,6 +61,7 @@ def makeInventory(json):
 def parse_data(json):
     """
     Here you will add your code to suit your needs.
+    It is called for the events that don't match any action saved from the configuration UI.
     Do not delete the first chunk of code below.
     """
 
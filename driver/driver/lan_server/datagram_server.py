@@ -0,0 +1,122 @@
+"""
+UDP receiver for sampled streams (ADC channels, gamepad axes) where only the newest value matters.
+
+A datagram is : magic (B), version (B), epoch (I), sequence number (Q), JSON request, HMAC-SHA256 of everything before it (16 bytes).
+The HMAC key is the session key sent when pairing. Samples older than the last one received for the same stream are dropped.
+The epoch is drawn by the Pi each time it opens a sender, its sequence numbers start again from there.
+"""
+import hmac
+import socket
+import threading
+from collections import deque
+from hashlib import sha256
+from json import loads
+from struct import Struct
+from time import time
+
+MAGIC = 0xA6
+VERSION = 2
+HEADER = Struct("<BBIQ")
+MAC_SIZE = 16
+
+
+def sign(key, data):
+    return hmac.new(str(key).encode(), data, sha256).digest()[:MAC_SIZE]
+
+
+class DatagramServer:
+    def __init__(self, port, get_session, consume, verbose=False):
+        """
+        :param get_session: function returning (Pi's ip, connection code, session key).
+        :param consume: function called with {"code": ..., "requests": [request]}.
+        """
+        self.port = port
+        self.get_session = get_session
+        self.consume = consume
+        self.verbose = verbose
+
+        self.last_sequences = {}
+        self.session_key = None
+        self.epoch = None
+        self.retired_epochs = deque(maxlen=32)  # datagrams of an older sender are late or replayed
+
+        self.received = 0
+        self.stale = 0
+        self.rejected = 0
+
+        self.socket = None
+        self.running = False
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('0.0.0.0', self.port))
+        self.running = True
+
+        listener = threading.Thread(name="Datagram Server", target=self.receive_loop, daemon=True)
+        listener.start()
+        self.log(f"Datagram server listening on {self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.socket is not None:
+            self.socket.close()
+
+    def receive_loop(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except OSError:
+                break
+
+            try:
+                self.handle(data, address[0])
+            except Exception as error:
+                self.rejected += 1
+                self.log(f"Datagram from {address[0]} rejected : {error}")
+
+    def handle(self, data, ip):
+        received = time()
+        pi_ip, code, key = self.get_session()
+        if not key or ip != pi_ip or len(data) < HEADER.size + MAC_SIZE:
+            raise Exception("Unknown sender")
+
+        signed, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+        if not hmac.compare_digest(sign(key, signed), mac):
+            raise Exception("Bad signature")
+
+        magic, version, epoch, sequence = HEADER.unpack_from(signed)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Not a RaspiMote datagram")
+
+        if key != self.session_key:  # new pairing, sequences start again
+            self.session_key = key
+            self.epoch = None
+            self.retired_epochs.clear()
+            self.last_sequences = {}
+
+        if epoch != self.epoch:
+            if epoch in self.retired_epochs:
+                self.stale += 1
+                return
+            if self.epoch is not None:  # the Pi reconnected, sequences start again
+                self.retired_epochs.append(self.epoch)
+            self.epoch = epoch
+            self.last_sequences = {}
+
+        request = loads(signed[HEADER.size:])
+        stream = (request["type"], request["id"], request["event_type"])
+
+        if sequence <= self.last_sequences.get(stream, -1):
+            self.stale += 1
+            return
+
+        self.last_sequences[stream] = sequence
+        self.received += 1
+        self.consume({"code": code, "requests": [request], "received": received})
+
+    def stats(self):
+        return {"received": self.received, "stale": self.stale, "rejected": self.rejected}
@@ -1,93 +1,180 @@
-from json import loads
-import json
-
-
-def get_conf_file(path):
-    try:
-        with open(path, "r") as trg_actions:
-            #print("Reading trigger_actions file")
-            trigger_actions = loads(trg_actions.read())
-            return trigger_actions
-    except Exception:
-        print("An error occured")
-        trigger_actions_file = open(path, "w", encoding="utf-8")
-        print("Created new trigger_actions file")
-        trigger_actions = {}
-        trigger_actions_file.write(json.dumps(trigger_actions))
-
-        return trigger_actions    
-
-def save_conf_file(path, new_conf):
-    to_save = json.dumps(new_conf, indent=4)
-
-    with open(path, "w") as old_conf:
-            old_conf.write(to_save)
-            return
-
-
-
-def write_action(path, request):
-    conf = get_conf_file(path)
-
-    device_type = request["type"]
-    name = request["name"]
-    function = request["function"]
-
-    when = function["when"]
-    action_type = function["action_type"]
-    data = function["data"]
-
-    print(f"\nAdding : {device_type} called {name}")
-    print(f"when [{when}] : {action_type} -> {data}")
-
-
-
-    if device_type not in conf.keys():
-        conf.update({device_type: []})
-
-    i=0
-    for e in conf[device_type]:
-        if name in e.keys():
-            for fcn in conf[device_type][i][name]:  # Check if a fcn is already set to this "when"
-                if when == fcn["when"]:
-                    raise Exception("There is already a function set to this event.")
-            conf[device_type][i][name].append(function)
-            save_conf_file(path, conf)
-            return
-        i+=1
+from json import loads, dumps
+from os import path as os_path, replace, fsync, stat, remove
+from tempfile import NamedTemporaryFile
+from threading import RLock
 
-    conf[device_type].append({name: [function]})
+ANY = "*"
 
-    save_conf_file(path, conf)
 
+# The old UI saved button and ADC names as null (parseInt of "gpio 17"), JSON keys made it the string "null"
+MISSING_NAMES = ("null", "None")
 
 
-def delete_action(path, request):
+def migrate(conf):
     """
-    NOT TESTED : NEED BUTTON IN UI
+    Convert the old format {type: [{name: [function, ...]}, ...]} to {type: {name: {when: action}}},
+    and the missing names to ANY like write_action does.
     """
-    conf = get_conf_file(path)
-
-    device_type = request["type"]
-    name = request["name"]
-    function = request["function"]
-
-    when = function["when"]
-
-    print(f"\nDeleting : {device_type} called {name}")
-    print(f"when [{when}] : {action_type}")
-
-    if device_type not in conf.keys():  # should not happen if called from UI
-        raise Exception(f"The current configuration doesn't contain any function for this device type : {device_type}")
-
-    if name not in conf[device_type]:
-        raise Exception(f"The current configuration doesn't contain function '{name}' for device type '{device_type}'")
-
-    conf[device_type][name].pop()
-    
-
-
-
+    keyed = {}
+    for device_type, devices in conf.items():
+        if type(devices) == dict:  # already keyed
+            devices = [{name: whens} for name, whens in devices.items()]
+
+        keyed[device_type] = {}
+        for device in devices:
+            for name, functions in device.items():
+                name = ANY if name in MISSING_NAMES else str(name)
+                whens = keyed[device_type].setdefault(name, {})
+                if type(functions) == dict:
+                    for when, function in functions.items():
+                        whens.setdefault(when, function)
+                    continue
+                for function in functions:
+                    whens[function["when"]] = {"action_type": function["action_type"], "data": function.get("data")}
+    return keyed
+
+
+class ConfigStore:
+    def __init__(self, path):
+        """
+        In-memory copy of the trigger_actions file : {device type: {name: {when: {"action_type": ..., "data": ...}}}}.
+        Every change is written to a temporary file then renamed over the old one, so the file is never half written.
+
+        :param path: trigger_actions file.
+        """
+        self.path = path
+        self.lock = RLock()
+        self.conf = {}
+        self.mtime = None
+        self.failed_mtime = None  # modification time of a file that couldn't be reloaded, not read again
+        self.version = 0
+        self.load()
+
+    def load(self, initial=True):
+        """
+        :param initial: False when reloading a file changed by something else, a file that can't be read then
+                        is only reported and the rules already loaded are kept, it may be in the middle of a save.
+        """
+        with self.lock:
+            mtime = None
+            try:
+                mtime = stat(self.path).st_mtime
+                with open(self.path, "r", encoding="utf-8") as trg_actions:
+                    conf = loads(trg_actions.read())
+
+            except (OSError, ValueError) as error:
+                if initial:
+                    self.recover(error)
+                    return
+                print(f"trigger_actions file not reloaded ({error}), keeping the current rules")
+                self.failed_mtime = mtime
+                return
+
+            keyed = migrate(conf)
+            if keyed != conf:
+                print("trigger_actions file converted to the keyed format")
+                self.save(keyed)
+                return
+
+            self.conf = conf
+            self.mtime = mtime
+            self.version += 1
+
+    def recover(self, error):
+        """
+        Start from an empty file when the file is missing or unreadable at startup.
+        """
+        if isinstance(error, FileNotFoundError):
+            print("Created new trigger_actions file")
+            self.save({})
+            return
 
-def get_actions_file(path):
-    return get_conf_file(path)
+        broken = self.path + ".broken"
+        print(f"trigger_actions file unreadable ({error}), moved to {broken}")
+        replace(self.path, broken)
+        self.save({})
+
+    def refresh(self):
+        """
+        Load the file again if it was modified by something else than this store.
+        """
+        try:
+            mtime = stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime != self.mtime and mtime != self.failed_mtime:
+            self.load(initial=False)
+
+    def save(self, conf):
+        with self.lock:
+            folder = os_path.dirname(self.path)
+            with NamedTemporaryFile("w", dir=folder, prefix=".trigger_actions.", delete=False, encoding="utf-8") as temporary:
+                temporary.write(dumps(conf, indent=4))
+                temporary.flush()
+                fsync(temporary.fileno())
+
+            try:
+                replace(temporary.name, self.path)
+            except OSError:
+                remove(temporary.name)
+                raise
+
+            self.conf = conf
+            self.mtime = stat(self.path).st_mtime
+            self.version += 1
+
+    def get_actions(self):
+        return self.conf
+
+    def write_action(self, request):
+        device_type = request["type"]
+        name = ANY if request["name"] is None else str(request["name"])
+        function = request["function"]
+
+        when = function["when"]
+        action_type = function["action_type"]
+        data = function["data"]
+
+        print(f"\nAdding : {device_type} called {name}")
+        print(f"when [{when}] : {action_type} -> {data}")
+
+        with self.lock:
+            whens = self.conf.get(device_type, {}).get(name, {})
+            if when in whens:
+                raise Exception("There is already a function set to this event.")
+
+            conf = {device_type: dict(names) for device_type, names in self.conf.items()}
+            names = conf.setdefault(device_type, {})
+            names[name] = dict(whens)
+            names[name][when] = {"action_type": action_type, "data": data}
+
+            self.save(conf)
+
+    def delete_action(self, request):
+        device_type = request["type"]
+        name = ANY if request["name"] is None else str(request["name"])
+        when = request["function"]["when"]
+
+        print(f"\nDeleting : {device_type} called {name}")
+        print(f"when [{when}]")
+
+        with self.lock:
+            if device_type not in self.conf:
+                raise Exception(f"The current configuration doesn't contain any function for this device type : {device_type}")
+
+            if name not in self.conf[device_type] or when not in self.conf[device_type][name]:
+                raise Exception(f"The current configuration doesn't contain function '{when}' for '{name}' ({device_type})")
+
+            conf = {device_type: dict(names) for device_type, names in self.conf.items()}
+            whens = dict(conf[device_type][name])
+            del whens[when]
+
+            if whens:
+                conf[device_type][name] = whens
+            else:
+                del conf[device_type][name]
+                if not conf[device_type]:
+                    del conf[device_type]
+
+            self.save(conf)
@@ -0,0 +1,86 @@
+"""
+Fixed pool of workers running the actions.
+Events of one device (type, id) always go to the same worker so they run in order,
+events of different devices run in parallel.
+"""
+import threading
+from collections import deque
+
+
+class KeyedExecutor:
+    def __init__(self, workers=4, max_queue=256, policy="reject", verbose=False):
+        """
+        :param workers: number of worker threads.
+        :param max_queue: maximum number of events waiting per worker.
+        :param policy: what to do when a worker queue is full : "reject" the new event, "drop_oldest" or "block" the receiver.
+        """
+        if policy not in ("reject", "drop_oldest", "block"):
+            raise Exception(f"Unknown queue policy : {policy}")
+
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.verbose = verbose
+
+        self.queues = [deque() for _ in range(workers)]
+        self.conditions = [threading.Condition() for _ in range(workers)]
+
+        # Counters kept per worker : submitted, rejected, dropped and max_depth are changed with the worker's condition held,
+        # failed only by the worker itself, so the receiving threads never update the same counter
+        self.counters = [{"submitted": 0, "rejected": 0, "dropped": 0, "failed": 0, "max_depth": 0} for _ in range(workers)]
+
+        for index in range(workers):
+            worker = threading.Thread(name=f"Processor {index}", target=self.work, args=[index], daemon=True)
+            worker.start()
+
+    def submit(self, key, function, *args):
+        """
+        Queue function(*args) on the worker in charge of key.
+
+        :return: False if the event was rejected because the queue is full.
+        """
+        index = hash(key) % self.workers
+        tasks = self.queues[index]
+        condition = self.conditions[index]
+        counters = self.counters[index]
+
+        with condition:
+            if len(tasks) >= self.max_queue:
+                if self.policy == "reject":
+                    counters["rejected"] += 1
+                    return False
+
+                elif self.policy == "drop_oldest":
+                    tasks.popleft()
+                    counters["dropped"] += 1
+
+                else:
+                    condition.wait_for(lambda: len(tasks) < self.max_queue)
+
+            tasks.append((function, args))
+            counters["submitted"] += 1
+            if len(tasks) > counters["max_depth"]:
+                counters["max_depth"] = len(tasks)
+            condition.notify_all()
+            return True
+
+    def work(self, index):
+        tasks = self.queues[index]
+        condition = self.conditions[index]
+
+        while True:
+            with condition:
+                condition.wait_for(lambda: len(tasks) > 0)
+                function, args = tasks.popleft()
+                condition.notify_all()
+
+            try:
+                function(*args)
+            except Exception as error:
+                self.counters[index]["failed"] += 1
+                print(f"Error while processing event : {error}")
+
+    def stats(self):
+        totals = {name: sum(counters[name] for counters in self.counters) for name in ("submitted", "rejected", "dropped", "failed")}
+        return {"depth": [len(tasks) for tasks in self.queues], "max_depth": max(counters["max_depth"] for counters in self.counters),
+                **totals, "workers": self.workers, "policy": self.policy}
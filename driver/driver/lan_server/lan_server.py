@@ -11,19 +11,19 @@
 """
 Build a web server to receive RaspiMote's requests and Driver's configuration.
 """
-from command_processor import process
-import threading
+from command_processor import process, latency, rules, store
+from dispatcher import KeyedExecutor
 from flask_cors import CORS
-from flask import Flask, request, send_file
+from flask import Flask, request, Response
 from json import load, loads, dumps
 from os import path, getenv
 from time import time
 from sys import platform
 from subprocess import run
 
-from defs import *
-
 from built_in_fcn import actions
+import wire
+from assets import load_assets
 
 app = Flask(__name__)
 CORS(app)
@@ -38,257 +38,320 @@ elif platform == "darwin": # EXPERIMENTAL
 file = load(open(path.join(config_file_path, "pi_ip.raspimote")))
 pi_ip = file["ip"]
 connection_code = file["code"]
-trigger_actions_file_path = path.join(config_file_path, "trigger_actions.raspimote")
+session_key = file.get("key")
+pending_pi_ip = None  # address seen in a discovery probe, trusted after a TLS request from it
 
+wire_decoder = wire.WireDecoder()
 
-@app.route('/action', methods = ['POST'])
-def action():
+ui_assets = load_assets()
 
-    ip = request.remote_addr
-    if pi_ip != ip:
-        return '<h1>Not authorized.</h1><h2>IPs do not match.</h2>', 403
-    else:
-        json = request.json
-        code = json["code"]
+# Routes used by the Pi, every other route is only served to localhost
+PI_ROUTES = ("/action", "/test")
 
-        if code != connection_code:
-            return '<h1>Not authorized.</h1><h2>Codes do not match.</h2>', 403
-        else:
-            if json["request"]["type"] != "ping":
-                processor = threading.Thread(name='Processor', target=process, args=[json])
-                processor.start()
+executor = KeyedExecutor(workers=4, max_queue=256, policy="reject")
 
-            return "True"
 
+def configure_executor(workers=4, max_queue=256, policy="reject"):
+    """
+    Replace the pool running the actions, call it before the server starts.
 
+    :param policy: "reject" (answer 503), "drop_oldest" or "block" when a device's queue is full.
+    """
+    global executor
+    executor = KeyedExecutor(workers, max_queue, policy)
 
-#### Configuration ####
 
-#@app.route('/config/add_action', methods = ['POST'])   <- NEED TO BE ADDED
-@app.route('/config', methods = ['POST'])
-def add_action():
-    if request.remote_addr == "127.0.0.1":
-        conf_req = loads(list(request.form.to_dict().keys())[0])
-        print(f"Adding action : {conf_req}")
+def submit_events(json):
+    """
+    Queue events for the processor pool, events of the same device run in order.
 
-        write_action(trigger_actions_file_path, conf_req)
+    :param json: {"code": ..., "requests": [...], "received": ...}
+    :return: False if at least one event was rejected.
+    """
+    accepted = True
+    for event in json["requests"]:
+        if event["type"] == "ping":
+            continue
+        key = (event["type"], event.get("id"))
+        if not executor.submit(key, process, {"code": json["code"], "request": event, "received": json.get("received")}):
+            accepted = False
+    return accepted
 
-        return "Configuration modified successfully."
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
+def get_session():
+    return pi_ip, connection_code, session_key
 
-@app.route('/config/remove_action', methods = ['POST'])
-def remove_action():
-    if request.remote_addr == "127.0.0.1":
-        conf_req = loads(list(request.form.to_dict().keys())[0])
-        print(f"Removing action : {conf_req}")
 
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+def propose_pi_ip(ip):
+    """
+    Called by the discovery when the paired Pi probes from a new address.
+    A probe can be replayed from any address, the new one is only used after a request from it carries the connection code.
+    """
+    global pending_pi_ip
+    if ip != pi_ip:
+        pending_pi_ip = ip
 
 
-@app.route('/config/get_actions', methods = ['POST'])
-def get_actions():
-    if request.remote_addr == "127.0.0.1":
-        actions = get_actions_file(trigger_actions_file_path)
-        print(f"Saved actions : {actions}")
-        return dumps(actions)
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+def set_pi_ip(ip):
+    global pi_ip, pending_pi_ip
+    pending_pi_ip = None
+    if ip == pi_ip:
+        return
 
-#### End Configuration ####
+    print(f"Pi's address changed : {pi_ip} -> {ip}")
+    pi_ip = ip
+    with open(path.join(config_file_path, "pi_ip.raspimote"), "r+") as pi_ip_file:
+        saved = load(pi_ip_file)
+        saved["ip"] = ip
+        pi_ip_file.seek(0)
+        pi_ip_file.write(dumps(saved))
+        pi_ip_file.truncate()
 
 
-@app.route('/')
-def config_ui():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/ui_model.html")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+def known_address(ip):
+    """
+    Call it once the code of the request was checked.
 
-@app.route('/style.css')
-def config_css():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/style.css")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    :return: True if ip is the Pi's address, or the one learnt from its last probe.
+    """
+    if ip == pi_ip:
+        return True
 
-@app.route('/initElements.js')
-def config_js1():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/initElements.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    if ip is not None and ip == pending_pi_ip:
+        set_pi_ip(ip)
+        return True
 
-@app.route('/showHide.js')
-def config_js2():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/showHide.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    return False
 
-@app.route('/showHideButton.js')
-def config_js3():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/showHideButton.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/showHideADC.js')
-def config_js4():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/showHideADC.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+def authorize(ip, code):
+    return code == connection_code and known_address(ip)
 
-@app.route('/showHideKeyboard.js')
-def config_js5():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/showHideKeyboard.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
+def check_sender(json):
+    """
+    Verify that a request comes from the paired Pi.
 
-@app.route('/showHideGamepad.js')
-def config_js6():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/showHideGamepad.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    :return: None if authorized, else the error response.
+    """
+    if json["code"] != connection_code:
+        return '<h1>Not authorized.</h1><h2>Codes do not match.</h2>', 403
 
-@app.route('/saveButton.js')
-def config_js7():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/saveButton.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    if not known_address(request.remote_addr):
+        return '<h1>Not authorized.</h1><h2>IPs do not match.</h2>', 403
 
-@app.route('/saveADC.js')
-def config_js8():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/saveADC.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    return None
 
-@app.route('/saveKeyboard.js')
-def config_js9():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/saveKeyboard.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/saveGamepad.js')
-def config_js10():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/saveGamepad.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+@app.before_request
+def localhost_only():
+    if request.path.startswith(PI_ROUTES):
+        return None
 
-@app.route('/jquery.js')
-def jquery():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/jquery-3.6.0.min.js", mimetype="text/javascript")
-    else:
+    if request.remote_addr != "127.0.0.1":
         return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/sweetalert.js')
-def sweetalert():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/sweetalert2.all.min.js", mimetype="text/javascript")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/sweetalert.css')
-def sweetalert_css():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/js/sweetalert2.borderless.min.css")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+@app.route('/action', methods = ['POST'])
+def action():
+    received = time()
+    json = request.json
+    error = check_sender(json)
+    if error is not None:
+        return error
+
+    if not submit_events({"code": json["code"], "requests": [json["request"]], "received": received}):
+        return "Busy", 503
+
+    return "True"
+
+
+@app.route('/action/batch', methods = ['POST'])
+def action_batch():
+    """
+    Receive several events at once. Events of the same device are processed in the order they were sent,
+    events of different devices may run in parallel (see dispatcher.KeyedExecutor).
+    """
+    received = time()
+    json = request.json
+    error = check_sender(json)
+    if error is not None:
+        return error
+
+    json["received"] = received
+    if not submit_events(json):
+        return "Busy", 503
+
+    return "True"
+
+
+@app.route('/action/wire', methods = ['POST'])
+def action_wire():
+    """
+    Negotiate the binary format and receive its name tables.
+    """
+    json = request.json
+    error = check_sender(json)
+    if error is not None:
+        return error
+
+    if json.get("reset"):
+        wire_decoder.reset()
+
+    if "tables" in json:
+        try:
+            wire_decoder.update(json["tables"])
+        except Exception as error:
+            return str(error), 409
 
+    return dumps({"versions": wire.VERSIONS})
 
-@app.route('/RaspiMote_logo.ico')
-def config_rsp_ico():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/RaspiMote_logo.ico")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/RaspiMote_logo_500px.png')
-def config_rsp_png():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/RaspiMote_logo_500px.png")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+@app.route('/action/bin', methods = ['POST'])
+def action_bin():
+    received = time()
+    frame = request.get_data()
+    try:
+        if str(wire_decoder.read_code(frame)) != connection_code:
+            return '<h1>Not authorized.</h1><h2>Codes do not match.</h2>', 403
+        if not known_address(request.remote_addr):
+            return '<h1>Not authorized.</h1><h2>IPs do not match.</h2>', 403
+        requests = wire_decoder.decode(frame)
+    except Exception as error:
+        return str(error), 400
+
+    if not submit_events({"code": connection_code, "requests": requests, "received": received}):
+        return "Busy", 503
+
+    return "True"
 
-@app.route('/loading.gif')
-def gif_loading():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/loading.gif")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
 
-@app.route('/xbox_one.png')
-def xbox_one_controller():
-    if request.remote_addr == "127.0.0.1":
-        return send_file("ui/xbox_one.png")
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+
+#### Configuration ####
+
+#@app.route('/config/add_action', methods = ['POST'])   <- NEED TO BE ADDED
+@app.route('/config', methods = ['POST'])
+def add_action():
+    conf_req = loads(list(request.form.to_dict().keys())[0])
+    print(f"Adding action : {conf_req}")
+
+    try:
+        store.write_action(conf_req)
+    except Exception as error:
+        return str(error), 409
+    rules.reload()
+
+    return "Configuration modified successfully."
+
+
+@app.route('/config/remove_action', methods = ['POST'])
+def remove_action():
+    conf_req = loads(list(request.form.to_dict().keys())[0])
+    print(f"Removing action : {conf_req}")
+
+    try:
+        store.delete_action(conf_req)
+    except Exception as error:
+        return str(error), 404
+    rules.reload()
+
+    return "Action removed successfully."
+
+
+@app.route('/config/get_actions', methods = ['POST'])
+def get_actions():
+    actions = store.get_actions()
+    print(f"Saved actions : {actions}")
+    return dumps(actions)
+
+#### End Configuration ####
+
+
+@app.route('/stats/dispatch')
+def dispatch_stats():
+    """
+    Queue depth of each processor and number of rejected or dropped events.
+    """
+    return dumps(executor.stats())
+
+
+@app.route('/stats/latency')
+def latency_stats():
+    """
+    Latency percentiles in milliseconds for each stage, add ?reset=1 to start again from zero.
+    """
+    summary = latency.summary()
+    if request.args.get("reset"):
+        latency.reset()
+    return dumps(summary)
+
+
+@app.route('/', defaults={"name": ""})
+@app.route('/<path:name>')
+def ui_asset(name):
+    asset = ui_assets.get(name)
+    if asset is None:
+        return "Not found.", 404
+
+    etag = f'"{asset.etag}"'
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control(request.args.get("v")), "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return "", 304, headers
+
+    encoding, body = asset.select(request.headers.get("Accept-Encoding", ""))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
 
 @app.route('/get_inventory', methods = ['POST'])
 def config_get_inventory():
-    if request.remote_addr == "127.0.0.1":
-        try:
-            with open (path.join(config_file_path, "inventory.raspimote"), "r") as inventory:
-                return inventory.read()
-        except FileNotFoundError:
-            return "INVENTORY_NOT_FOUND", 500
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can configure RaspiMote.</h2>', 403
+    try:
+        with open (path.join(config_file_path, "inventory.raspimote"), "r") as inventory:
+            return inventory.read()
+    except FileNotFoundError:
+        return "INVENTORY_NOT_FOUND", 500
 
 
 @app.route('/open_editor', methods = ['POST'])
 def open_editor():
-    if request.remote_addr == "127.0.0.1":
-        if platform == "win32":
-            try:
-                run(["C:\\Program Files\\RaspiMote\\py\\pythonw.exe", "C:\\Program Files\\RaspiMote\\py\\Lib\\idlelib\\idle.py", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
-                return "True"
-            except:
-                pass
-            try:
-                run(["code", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
-                return "True"
-            except:
-                pass
-            try:
-                run(["notepad", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
-                return "True"
-            except:
-                pass
-            return "False", 500
-        elif platform == "linux":
-            try:
-                run(["idle3", f"{config_file_path}/custom_fcn/custom_fcn.py"])
-                return "True"
-            except:
-                pass
-            try:
-                run(["code", f"{config_file_path}/custom_fcn/custom_fcn.py"])
-                return "True"
-            except:
-                pass
-            try:
-                run(["gedit", f"{config_file_path}/custom_fcn/custom_fcn.py"])
-            except:
-                pass
-            try:
-                run(["leafpad", f"{config_file_path}/custom_fcn/custom_fcn.py"])
-            except:
-                pass
-            return "False", 500
-    else:
-        return '<h1>Not authorized.</h1><h2>Only <code>localhost</code> can open an editor.</h2>', 403
+    if platform == "win32":
+        try:
+            run(["C:\\Program Files\\RaspiMote\\py\\pythonw.exe", "C:\\Program Files\\RaspiMote\\py\\Lib\\idlelib\\idle.py", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
+            return "True"
+        except:
+            pass
+        try:
+            run(["code", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
+            return "True"
+        except:
+            pass
+        try:
+            run(["notepad", f"{config_file_path}\\custom_fcn\\custom_fcn.py"])
+            return "True"
+        except:
+            pass
+        return "False", 500
+    elif platform == "linux":
+        try:
+            run(["idle3", f"{config_file_path}/custom_fcn/custom_fcn.py"])
+            return "True"
+        except:
+            pass
+        try:
+            run(["code", f"{config_file_path}/custom_fcn/custom_fcn.py"])
+            return "True"
+        except:
+            pass
+        try:
+            run(["gedit", f"{config_file_path}/custom_fcn/custom_fcn.py"])
+        except:
+            pass
+        try:
+            run(["leafpad", f"{config_file_path}/custom_fcn/custom_fcn.py"])
+        except:
+            pass
+        return "False", 500
 
 @app.route('/test')
 def test():
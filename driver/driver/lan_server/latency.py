@@ -0,0 +1,88 @@
+"""
+Latency histograms of the events received from the Pi.
+
+Stages :
+    transport : capture on the Pi -> received by the driver (needs both clocks synchronized, NTP is enough on a LAN)
+    queue     : received -> dispatched to the action
+    action    : dispatched -> action completed
+    total     : capture -> action completed
+"""
+from math import log
+from threading import Lock
+
+STAGES = ("transport", "queue", "action", "total")
+
+MIN_LATENCY = 0.00001  # 10 µs
+MAX_LATENCY = 100
+GROWTH = 1.05  # each bucket is 5 % wider than the previous one
+BUCKETS = int(log(MAX_LATENCY / MIN_LATENCY) / log(GROWTH)) + 2
+
+
+class LatencyTracker:
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {stage: [0] * BUCKETS for stage in STAGES}
+            self.counts = {stage: 0 for stage in STAGES}
+            self.maximums = {stage: 0 for stage in STAGES}
+            self.clock_skew = 0
+
+    def record(self, stage, seconds):
+        if seconds <= MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = min(BUCKETS - 1, int(log(seconds / MIN_LATENCY) / log(GROWTH)) + 1)
+
+        with self.lock:
+            self.histograms[stage][bucket] += 1
+            self.counts[stage] += 1
+            if seconds > self.maximums[stage]:
+                self.maximums[stage] = seconds
+
+    def trace(self, request, received, dispatched, completed):
+        """
+        Record the stages of one event.
+
+        :param request: the event, its "t" field is the capture time on the Pi.
+        :param received: time when the driver received the event, None if unknown.
+        """
+        if received is not None:
+            self.record("queue", dispatched - received)
+        self.record("action", completed - dispatched)
+
+        captured = request.get("t")
+        if captured:
+            if received is not None and received >= captured:
+                self.record("transport", received - captured)
+            elif received is not None:
+                with self.lock:
+                    self.clock_skew += 1  # Pi's clock is ahead, transport can't be measured
+
+            if completed >= captured:
+                self.record("total", completed - captured)
+
+    def percentile(self, stage, fraction):
+        target = fraction * self.counts[stage]
+        seen = 0
+        for bucket, count in enumerate(self.histograms[stage]):
+            seen += count
+            if count and seen >= target:
+                return min(MIN_LATENCY * GROWTH ** bucket, self.maximums[stage])  # upper bound of the bucket
+        return 0
+
+    def summary(self):
+        """
+        :return: {stage: {"count", "p50", "p95", "p99", "max"}}, latencies in milliseconds.
+        """
+        with self.lock:
+            summary = {}
+            for stage in STAGES:
+                summary[stage] = {"count": self.counts[stage]}
+                for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                    summary[stage][name] = round(self.percentile(stage, fraction) * 1000, 3)
+                summary[stage]["max"] = round(self.maximums[stage] * 1000, 3)
+            summary["clock_skew"] = self.clock_skew
+            return summary
@@ -0,0 +1,222 @@
+"""
+Compile the trigger_actions saved by the configuration UI into a dictionary :
+(device type, name, when) -> action, so each event is dispatched with one lookup.
+The rules are compiled again when the configuration store changes (UI or file modification time).
+"""
+from time import monotonic
+
+from built_in_fcn.actions import type_text, run_command, press_key, change_volume, keys_unbatched
+
+# Pi's device types -> types saved by the configuration UI
+DEVICE_TYPES = {"button": "button", "ADC": "adc", "USB": "usb_hid", "gamepad": "xbox_one_gamepad", "matrix": "matrix"}
+
+# Events that don't have a "when" of their own
+TRIGGERED = ("button", "adc", "matrix")
+
+MOUSE_EVENTS = {"btn_left": "button_left", "btn_right": "button_right", "btn_side": "button_previous", "btn_extra": "button_next"}
+
+# xbox360controller names -> evdev names saved by the UI (ui/js/showHideGamepad.js), raw_mode already gives the evdev ones
+GAMEPAD_NAMES = {"button_a": "btn_a", "button_b": "btn_b", "button_x": "btn_x", "button_y": "btn_y",
+                 "button_trigger_l": "btn_tl", "button_trigger_r": "btn_tr", "button_thumb_l": "btn_thumbl",
+                 "button_thumb_r": "btn_thumbr", "button_select": "btn_select", "button_start": "btn_start",
+                 "button_mode": "btn_mode", "trigger_l": "abs_z", "trigger_r": "abs_rz"}
+
+# The hat is saved as one rule per direction : abs_hat0x>-1.0, abs_hat0x>1.0, abs_hat0y>-1.0, abs_hat0y>1.0
+HATS = ("abs_hat0x", "abs_hat0y")
+HAT_THRESHOLD = 0.5
+
+MEDIA_KEYS = {"volup", "voldown", "mute", "pp", "next", "previous"}
+OTHER_KEYS = {"psc", "pos1", "end", "del", "enter", "backspace", "tab", "pup", "pdown", "shift", "ctrl", "alt", "super"}
+
+ANY = "*"
+
+
+def normalize(name):
+    if name is None:
+        return ANY
+    return str(name).lower().replace(" ", "_")
+
+
+def key_category(key):
+    if key in MEDIA_KEYS:
+        return "media"
+    if key in OTHER_KEYS:
+        return "other"
+    if key[:1] == "f" and key[1:].isdigit():
+        return "fn"
+    if key.isdigit():
+        return "numeral"
+    return "alphabet"
+
+
+def volume_level(request):
+    """
+    :return: the event's value in percent, gamepad axes go from -1 to 1.
+    """
+    value = request["value"]
+    if request["type"] == "gamepad":
+        return round((min(max(value, -1), 1) + 1) * 50)
+    return value
+
+
+def run_unbatched(custom_function, request):
+    with keys_unbatched():  # user code may sleep between two keys
+        custom_function(request)
+
+
+def build_action(function):
+    """
+    :param function: {"action_type": ..., "data": ...} as saved by the UI.
+    :return: a callable taking the event, None if the action is unknown.
+    """
+    action_type = function["action_type"]
+    data = function.get("data")
+
+    if action_type == "press_key":
+        category = key_category(data)
+        return lambda request: press_key(category, data)
+
+    elif action_type == "type_text":
+        return lambda request: type_text(data)
+
+    elif action_type == "run_command":
+        return lambda request: run_command(data)
+
+    elif action_type == "change_volume":
+        return lambda request: change_volume(volume_level(request))
+
+    elif action_type == "run_custom_function":
+        try:
+            import custom_fcn
+            custom_function = getattr(custom_fcn, data)
+        except (ImportError, AttributeError) as error:
+            print(f"Custom function {data} not found : {error}")
+            return None
+        return lambda request: run_unbatched(custom_function, request)
+
+    print(f"Unknown action type : {action_type}")
+    return None
+
+
+def compile_rules(conf):
+    """
+    :param conf: {device type: {name: {when: action}}} from the configuration store.
+    :return: {(device type, name, when): action}
+    """
+    index = {}
+    for device_type, names in conf.items():
+        for name, whens in names.items():
+            if device_type == "xbox_one_gamepad" and not str(name).isdigit():
+                name = None  # the UI doesn't tell which controller, the rule applies to every one
+
+            for when, function in whens.items():
+                action = build_action(function)
+                if action is not None:
+                    index[(device_type, normalize(name), normalize(when))] = action
+    return index
+
+
+def event_key(request):
+    """
+    :return: (device type, name, when) of an event, None if it can't trigger an action.
+    """
+    device_type = DEVICE_TYPES.get(request["type"])
+    if device_type is None:
+        return None
+
+    value = request["value"]
+
+    if device_type == "adc":
+        return device_type, normalize(request["id"]), "triggered"
+
+    if device_type in TRIGGERED:
+        if value != 1:
+            return None
+        return device_type, normalize(request["id"]), "triggered"
+
+    if device_type == "xbox_one_gamepad":
+        return gamepad_key(request)
+
+    when = normalize(request["event_type"])
+    if when == "scroll":
+        when = "scroll_up" if value > 0 else "scroll_down"
+    elif value != 1:  # only key presses, not releases or repeats
+        return None
+
+    return device_type, normalize(request["id"]), MOUSE_EVENTS.get(when, when)
+
+
+def gamepad_key(request):
+    """
+    Buttons trigger when pressed, the hat once per direction, the sticks and triggers on every move (their rules use the value).
+    """
+    name = normalize(request["event_type"])
+    name = GAMEPAD_NAMES.get(name, name)
+    value = request["value"]
+
+    if name in HATS:
+        if abs(value) < HAT_THRESHOLD:  # back to the center
+            return None
+        return "xbox_one_gamepad", normalize(request["id"]), f"{name}>{1.0 if value > 0 else -1.0}"
+
+    if not name.startswith("abs_") and value != 1:
+        return None
+
+    return "xbox_one_gamepad", normalize(request["id"]), name
+
+
+class RuleEngine:
+    def __init__(self, store, check_interval=0.5):
+        """
+        :param store: defs.ConfigStore of the trigger_actions file.
+        :param check_interval: minimum time in seconds between two checks of the file's modification time.
+        """
+        self.store = store
+        self.check_interval = check_interval
+        self.index = {}
+        self.version = None
+        self.checked = 0
+
+    def reload(self):
+        version = self.store.version
+        try:
+            index = compile_rules(self.store.get_actions())
+        except Exception as error:
+            print(f"trigger_actions not compiled, keeping previous rules : {error}")
+            self.version = version
+            return
+
+        self.index = index  # swapped in one assignment, dispatching threads see the old or the new index
+        self.version = version
+        print(f"{len(index)} rule(s) loaded")
+
+    def check(self):
+        now = monotonic()
+        if now - self.checked >= self.check_interval:
+            self.checked = now
+            self.store.refresh()
+
+        if self.store.version != self.version:
+            self.reload()
+
+    def dispatch(self, request):
+        """
+        Run the action configured for this event.
+
+        :return: False if no rule matches.
+        """
+        self.check()
+
+        key = event_key(request)
+        if key is None:
+            return False
+
+        index = self.index
+        action = index.get(key)
+        if action is None:
+            action = index.get((key[0], ANY, key[2]))
+            if action is None:
+                return False
+
+        action(request)
+        return True
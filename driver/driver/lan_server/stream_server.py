@@ -0,0 +1,181 @@
+"""
+Persistent TLS channel used by the Pi to push events without one HTTP request per event.
+
+Every frame is a 4 bytes big-endian length followed by the payload.
+The first frame sent by the Pi is a JSON hello : {"code": ...}.
+The next ones are JSON ({"request": ...}, {"requests": [...]} or {"tables": ...}) or binary frames (see wire.py).
+The driver answers with JSON acknowledgements : {"ack": number of frames handled, "rejected": how many of them were
+malformed or refused because the driver was busy}.
+"""
+import socket
+import ssl
+import threading
+from struct import Struct
+from json import loads, dumps
+from time import monotonic, time
+
+from wire import MAGIC
+
+LENGTH = Struct(">I")
+MAX_FRAME = 1 << 20
+
+
+def read_exactly(connection, size, idle_timeout=False):
+    """
+    :param idle_timeout: let socket.timeout through if it happens before the first byte.
+    """
+    data = b''
+    while len(data) < size:
+        try:
+            chunk = connection.recv(size - len(data))
+        except socket.timeout:
+            if idle_timeout and not data:
+                raise
+            continue
+
+        if not chunk:
+            raise ConnectionError("Stream closed")
+        data += chunk
+    return data
+
+
+def read_frame(connection):
+    size = LENGTH.unpack(read_exactly(connection, LENGTH.size, idle_timeout=True))[0]
+    if size > MAX_FRAME:
+        raise ConnectionError("Frame too large")
+    return read_exactly(connection, size)
+
+
+def write_frame(connection, payload):
+    connection.sendall(LENGTH.pack(len(payload)) + payload)
+
+
+class StreamServer:
+    def __init__(self, port, cert, key, authorize, consume, wire_decoder, ack_every=32, ack_interval=0.5, verbose=False):
+        """
+        :param authorize: function (ip, code) -> bool.
+        :param consume: function called with {"code": ..., "requests": [...]} for each frame, in order, returns False if refused.
+        :param wire_decoder: decoder shared with the HTTPS /action/bin route.
+        :param ack_every: send an acknowledgement every N frames...
+        :param ack_interval: ...or after this many seconds.
+        """
+        self.port = port
+        self.authorize = authorize
+        self.consume = consume
+        self.wire_decoder = wire_decoder
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
+        self.verbose = verbose
+
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+
+        self.socket = None
+        self.running = False
+
+        self.frames = 0
+        self.rejected = 0
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def start(self):
+        self.socket = socket.create_server(('0.0.0.0', self.port))
+        self.running = True
+
+        listener = threading.Thread(name="Stream Server", target=self.accept_loop, daemon=True)
+        listener.start()
+        self.log(f"Stream server listening on {self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.socket is not None:
+            self.socket.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                break
+
+            client = threading.Thread(name="Stream Client", target=self.serve, args=[connection, address], daemon=True)
+            client.start()
+
+    def serve(self, connection, address):
+        try:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self.context.wrap_socket(connection, server_side=True)
+
+            hello = loads(read_frame(connection))
+            if type(hello) != dict or not self.authorize(address[0], hello.get("code")):
+                self.log(f"Stream from {address[0]} refused")
+                write_frame(connection, dumps({"error": "Not authorized."}).encode())
+                return
+
+            code = hello["code"]
+            write_frame(connection, dumps({"ack": 0}).encode())
+            self.log(f"Stream opened by {address[0]}")
+
+            received = 0
+            rejected = 0
+            acked = 0
+            last_ack = monotonic()
+            connection.settimeout(self.ack_interval)
+
+            while self.running:
+                try:
+                    frame = read_frame(connection)
+                except socket.timeout:  # idle, acknowledge what is left
+                    if received != acked:
+                        write_frame(connection, dumps({"ack": received, "rejected": rejected}).encode())
+                        acked = received
+                        last_ack = monotonic()
+                    continue
+
+                try:
+                    accepted = self.handle_frame(code, frame)
+                except Exception as error:  # malformed frame (JSON, wire.py), the next ones can still be read
+                    self.log(f"Stream frame from {address[0]} rejected : {error}")
+                    accepted = False
+
+                received += 1
+                self.frames += 1
+                if not accepted:
+                    rejected += 1
+                    self.rejected += 1
+
+                if received - acked >= self.ack_every or monotonic() - last_ack >= self.ack_interval:
+                    write_frame(connection, dumps({"ack": received, "rejected": rejected}).encode())
+                    acked = received
+                    last_ack = monotonic()
+
+        except (ConnectionError, OSError, ssl.SSLError, ValueError) as error:  # ValueError : unreadable hello
+            self.log(f"Stream from {address[0]} closed : {error}")
+
+        finally:
+            connection.close()
+
+    def handle_frame(self, code, frame):
+        """
+        :return: False if the frame was refused.
+        """
+        received = time()
+
+        if frame[:1] == bytes([MAGIC]):
+            return self.consume({"code": code, "requests": self.wire_decoder.decode(frame), "received": received})
+
+        json = loads(frame)
+        if "tables" in json:
+            self.wire_decoder.update(json["tables"])
+            return True
+        elif "requests" in json:
+            return self.consume({"code": code, "requests": json["requests"], "received": received})
+        elif "request" in json:
+            return self.consume({"code": code, "requests": [json["request"]], "received": received})
+        return False
+
+    def stats(self):
+        return {"frames": self.frames, "rejected": self.rejected}
+
@@ -0,0 +1,85 @@
+"""
+Decoder for the compact binary event format sent by the Pi (see raspberrypi/pi/wire.py).
+"""
+from struct import Struct
+from threading import Lock
+
+MAGIC = 0xA5
+VERSIONS = [1, 2]
+
+HEADER = Struct("<BBIH")
+EVENTS = {
+    1: Struct("<BHHBdd"),
+    2: Struct("<BHHBddd"),  # + capture time on the Pi
+}
+
+VALUE_INT = 0
+VALUE_FLOAT = 1
+VALUE_PAIR = 2
+
+TABLES = ("types", "ids", "events")
+
+
+class WireDecoder:
+    def __init__(self):
+        self.tables = {table: [] for table in TABLES}
+        self.lock = Lock()
+
+    def reset(self):
+        with self.lock:
+            self.tables = {table: [] for table in TABLES}
+
+    def update(self, tables):
+        """
+        Add new entries to the name tables.
+
+        :param tables: {"types": {"start": 0, "values": [...]}, ...}
+        """
+        with self.lock:
+            for table in TABLES:
+                if table not in tables:
+                    continue
+                start = tables[table]["start"]
+                values = tables[table]["values"]
+
+                if start > len(self.tables[table]):
+                    raise Exception(f"Missing entries in wire table {table}")
+                self.tables[table][start:start + len(values)] = values
+
+    def read_code(self, frame):
+        magic, version, code, count = HEADER.unpack_from(frame)
+        if magic != MAGIC or version not in VERSIONS:
+            raise Exception("Not a RaspiMote frame")
+        return code
+
+    def decode(self, frame):
+        """
+        :return: list of {"type", "id", "event_type", "value", "t"} dictionaries, in the order they were sent.
+        """
+        magic, version, code, count = HEADER.unpack_from(frame)
+        if magic != MAGIC or version not in VERSIONS:
+            raise Exception("Not a RaspiMote frame")
+
+        event = EVENTS[version]
+        if len(frame) != HEADER.size + count * event.size:
+            raise Exception("Truncated frame")
+
+        types = self.tables["types"]
+        ids = self.tables["ids"]
+        events = self.tables["events"]
+
+        requests = []
+        for type_index, id_index, event_index, kind, first, second, *captured in event.iter_unpack(frame[HEADER.size:]):
+            if kind == VALUE_INT:
+                value = int(first)
+            elif kind == VALUE_FLOAT:
+                value = first
+            else:
+                value = [int(first), int(second)]
+
+            request = {"type": types[type_index], "id": ids[id_index], "event_type": events[event_index], "value": value}
+            if captured and captured[0]:
+                request["t"] = captured[0]
+            requests.append(request)
+
+        return requests
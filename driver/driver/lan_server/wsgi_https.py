@@ -1,8 +1,35 @@
 from raspimote_https.wsgi import Server as WSGIServer, PathInfoDispatcher as WSGIPathInfoDispatcher
 from raspimote_https.ssl.builtin import BuiltinSSLAdapter
 from sys import argv
+import ssl
 
-from lan_server import app
+from lan_server import app, authorize, get_session, propose_pi_ip, wire_decoder, submit_events
+from stream_server import StreamServer
+from datagram_server import DatagramServer
+from discovery import DiscoveryResponder
+
+
+# Server tuning, utility/tls_handshake_benchmark.py compares full and resumed handshakes
+# Reference copy : raspberrypi/pi/server_pi/wsgi_https.py repeats TLS_CIPHERS, TLS_TICKETS and tune_tls
+# because the Pi and the driver are installed separately, change both together (utility/check_copies.py compares them)
+TLS_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"  # TLS 1.2 suites, forward secrecy and AEAD only (TLS 1.3 suites are always fast)
+TLS_TICKETS = 2  # session tickets sent after each TLS 1.3 handshake
+KEEP_ALIVE_TIMEOUT = 30  # seconds an idle connection is kept open
+MIN_THREADS = 4
+MAX_THREADS = 16
+
+
+def tune_tls(context):
+    """
+    OpenSSL keeps a session cache for server contexts, tickets are enabled here so clients can also resume
+    with a ticket when the cache entry is gone. The context lives as long as the server, and so do its ticket keys.
+    """
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.options &= ~ssl.OP_NO_TICKET
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE
+    if hasattr(context, "num_tickets"):
+        context.num_tickets = TLS_TICKETS
 
 
 if "-verbose" in argv or "-v" in argv:
@@ -11,14 +38,40 @@ else:
     verbose = False
 
 my_app = WSGIPathInfoDispatcher({'/': app}, verbose=verbose)
-server = WSGIServer(('0.0.0.0', 9876), my_app, verbose=verbose)
+server = WSGIServer(('0.0.0.0', 9876), my_app, numthreads=MIN_THREADS, max=MAX_THREADS,
+                    timeout=KEEP_ALIVE_TIMEOUT, verbose=verbose)
 
 ssl_cert = "cert.pem"
 ssl_key = "key.key"
 server.ssl_adapter = BuiltinSSLAdapter(ssl_cert, ssl_key, verbose=verbose)
+tune_tls(server.ssl_adapter.context)
 
-if __name__ == '__main__':
+stream_server = StreamServer(9877, ssl_cert, ssl_key, authorize, submit_events, wire_decoder, verbose=verbose)
+tune_tls(stream_server.context)
+datagram_server = DatagramServer(9878, get_session, submit_events, verbose=verbose)
+discovery_responder = DiscoveryResponder("driver", lambda: get_session()[2], propose_pi_ip, verbose=verbose)
+
+def serve():
+    """
+    Run the LAN servers in this process until stop() is called.
+    """
+    stream_server.start()
+    datagram_server.start()
+    discovery_responder.start()
     try:
         server.start(verbose=verbose)
+    finally:
+        stream_server.stop()
+        datagram_server.stop()
+        discovery_responder.stop()
+
+
+def stop():
+    server.stop()
+
+
+if __name__ == '__main__':
+    try:
+        serve()
     except KeyboardInterrupt:
-        server.stop()
+        stop()
@@ -19,7 +19,7 @@ def main(argv):
     verbose = "-verbose" in argv or '-v' in argv
     debug_inventory = "inventory" in argv or "-i" in argv
 
-    pi = Pi("192.168.1.16", "WiFi", debug_inventory, verbose)
+    pi = Pi(None, "WiFi", debug_inventory, verbose)  # driver's IP learnt when pairing, then found again on the LAN
     pi.establish_connection()
 
 
@@ -1,10 +1,16 @@
 from gpiozero import Button, LED
 from threading import Thread
+from time import monotonic, sleep
 
 class Mixin:
-    def add_ADC_Device_PCF8591(self, number_channels):
+    def add_ADC_Device_PCF8591(self, number_channels, active_rate=20, idle_rate=2, idle_after=50):
         """
         I have no idea of how to support other ADCDevice for the moment.
+
+        :param number_channels: number of channels used, starting from channel 0.
+        :param active_rate: samples per second while a channel is moving.
+        :param idle_rate: samples per second once a channel hasn't changed for idle_after samples.
+        :param idle_after: number of unchanged samples before a channel goes idle.
         :return:
         """
         from ADCDevice import PCF8591
@@ -13,39 +19,122 @@ class Mixin:
         self.ADC_channels += (number_channels - 1)
 
         self.ADC_old_values = []
+        self.ADC_schedule = []
         for channel in range(self.ADC_channels + 1):
             self.ADC_old_values.append(int(self.ADC.analogRead(channel)))
+            self.register_device(("ADC", channel), "ADC", channel, f"ADC{channel}")
+            self.ADC_schedule.append({"active_rate": active_rate, "idle_rate": idle_rate, "idle_after": idle_after,
+                                      "unchanged": 0, "idle": False, "next": 0})
+
+        try:
+            self.build_ADC_filter()
+        except ImportError:
+            print(f"{self.term_warning}NumPy not installed, ADC values are not filtered.{self.term_endc}")
 
         adc_device_thread = Thread(name="USB Device Reading", target=self.run_ADC)
         adc_device_thread.start()
 
+    def configure_ADC_filter(self, mode="ema", size=5, alpha=0.3, deadband=2.0):
+        """
+        Filter ADC noise before deciding that a value changed (needs NumPy).
+        Can be called before or after add_ADC_Device_PCF8591.
+
+        :param mode: "ema" (exponential moving average), "median" (median of the last size samples) or "none".
+        :param size: number of samples kept per channel.
+        :param alpha: weight of the newest sample for "ema".
+        :param deadband: minimal change, in percent, for a new value to be sent.
+        """
+        self.ADC_filter_settings = {"mode": mode, "size": size, "alpha": alpha, "deadband": deadband}
+        if self.ADC is not None:
+            self.build_ADC_filter()
+
+    def build_ADC_filter(self):
+        from .adc_filter import ADCFilter
+
+        self.ADC_filter = ADCFilter(self.ADC_channels + 1, **self.ADC_filter_settings)
+        self.ADC_filter.prime(list(range(self.ADC_channels + 1)), self.ADC_old_values)
+        self.log(f"ADC filter : {self.ADC_filter.mode}, {self.ADC_filter.size} samples, deadband {self.ADC_filter.deadband} %")
+
+    def configure_ADC_channel(self, channel, active_rate=None, idle_rate=None, idle_after=None):
+        """
+        Change the sampling rates of one ADC channel, after add_ADC_Device_PCF8591.
+
+        :param channel: channel number.
+        :param active_rate: samples per second while the channel is moving.
+        :param idle_rate: samples per second once the channel is idle.
+        :param idle_after: number of unchanged samples before the channel goes idle.
+        """
+        schedule = self.ADC_schedule[channel]
+        if active_rate is not None:
+            schedule["active_rate"] = active_rate
+        if idle_rate is not None:
+            schedule["idle_rate"] = idle_rate
+        if idle_after is not None:
+            schedule["idle_after"] = idle_after
+        schedule["next"] = 0
+
+        self.log(f"ADC{channel} : {schedule['active_rate']} Hz active, {schedule['idle_rate']} Hz idle after {schedule['idle_after']} samples")
+
     def run_ADC(self):
-        idle = 0
-        time_sleep = 0.15
+        """
+        Sample every channel at its own rate. Each channel has a deadline, the thread sleeps until the nearest one.
+        Channels due at the same time are filtered together.
+        """
         while True:
-            for channel in range(self.ADC_channels + 1):
-                old = self.ADC_old_values[channel]
-                new = int(self.ADC.analogRead(channel))
+            now = monotonic()
+
+            due = [channel for channel in range(self.ADC_channels + 1) if self.ADC_schedule[channel]["next"] <= now]
+            if due:
+                values = [int(self.ADC.analogRead(channel)) for channel in due]
+                changes = dict(self.filter_ADC(due, values))
+
+                for channel in due:
+                    schedule = self.ADC_schedule[channel]
+                    self.update_ADC_schedule(channel, schedule, channel in changes, now)
 
-                if old not in [new - 1, new, new + 1]:
+                    if channel in changes:
+                        if self.verbose:
+                            print(f"ADC{channel} : {changes[channel]}", end='; ')
+                        self.send_data(("ADC", channel, "adc_event", changes[channel]), continuous=True, sampled=True)
 
-                    idle = 1
-                    time_sleep = 0.1
+            next_deadline = min(schedule["next"] for schedule in self.ADC_schedule)
+            sleep(max(0, next_deadline - monotonic()))
 
-                    self.ADC_old_values[channel] = new
+    def filter_ADC(self, channels, values):
+        """
+        :return: list of (channel, percent) for the channels that changed.
+        """
+        if self.ADC_filter is not None:
+            return self.ADC_filter.update(channels, values)
+
+        changes = []
+        for channel, new in zip(channels, values):
+            if self.ADC_old_values[channel] not in [new - 1, new, new + 1]:
+                self.ADC_old_values[channel] = new
+                changes.append((channel, int((new / 255) * 100)))
+        return changes
+
+    def update_ADC_schedule(self, channel, schedule, changed, now):
+        if changed:
+            if schedule["idle"]:
+                self.log(f"ADC{channel} active")
+            schedule["idle"] = False
+            schedule["unchanged"] = 0
 
-                    new = int((new / 255) * 100)
+        else:
+            schedule["unchanged"] += 1
+            if not schedule["idle"] and schedule["unchanged"] >= schedule["idle_after"]:
+                self.log(f"ADC{channel} sleep mode")
+                schedule["idle"] = True
 
-                    if self.verbose:
-                        print(f"ADC{channel} : {new}", end='; ')
-                    self.send_data(("ADC", channel, "adc_event", new))
+        if schedule["idle"]:
+            period = 1 / schedule["idle_rate"]
+        else:
+            period = 1 / schedule["active_rate"]
 
-                elif idle != 0:
-                    idle += 1
-                    if idle > 100:
-                        self.log("Sleep mode")
-                        time_sleep = 0.2
-                        idle = 0
+        schedule["next"] += period
+        if schedule["next"] <= now:  # too late, don't try to catch up
+            schedule["next"] = now + period
 
     def add_buttons(self, config):
         """
@@ -60,6 +149,79 @@ class Mixin:
 
             self.buttons.append(device)
             self.pins.append(pin)
+            self.register_device(device, "button", pin, f"GPIO{pin}")
+
+    def add_button_matrix(self, row_pins, column_pins, scan_rate=200, debounce=0.02):
+        """
+        Add a keypad matrix scanned by one thread : R rows and C columns give R x C keys with R + C pins.
+        Rows are driven low one after the other while columns are read with pull-ups.
+        Every key is debounced on its own, so any number of keys can be held (put a diode on each key to avoid ghosting).
+
+        :param row_pins: list of GPIO pins of the rows.
+        :param column_pins: list of GPIO pins of the columns.
+        :param scan_rate: full matrix scans per second.
+        :param debounce: time in seconds a key must stay in its new state before it is reported.
+        :return: index of the matrix, its keys are named "matrix{index}_{row * len(column_pins) + column}".
+        """
+        from gpiozero import DigitalOutputDevice, DigitalInputDevice
+
+        index = len(self.matrices)
+        rows = [DigitalOutputDevice(pin, active_high=False, initial_value=False) for pin in row_pins]
+        columns = [DigitalInputDevice(pin, pull_up=True) for pin in column_pins]
+
+        keys = []
+        for r in range(len(rows)):
+            for c in range(len(columns)):
+                key_id = f"matrix{index}_{r * len(columns) + c}"
+                keys.append(key_id)
+                self.register_device(("matrix", index, r, c), "matrix", key_id, f"R{r}C{c}")
+
+        matrix = {"rows": rows, "columns": columns, "keys": keys, "period": 1 / scan_rate,
+                  "debounce_scans": max(1, round(debounce * scan_rate))}
+        self.matrices.append(matrix)
+
+        self.log(f"Button matrix {index} : {len(rows)}x{len(columns)} keys, scanned at {scan_rate} Hz")
+
+        matrix_thread = Thread(name="Matrix Scanning", target=self.scan_matrix, args=[matrix])
+        matrix_thread.start()
+
+        return index
+
+    def scan_matrix(self, matrix):
+        rows = matrix["rows"]
+        columns = matrix["columns"]
+        keys = matrix["keys"]
+        period = matrix["period"]
+        debounce_scans = matrix["debounce_scans"]
+
+        states = [0] * len(keys)  # debounced state of each key
+        counters = [0] * len(keys)  # consecutive scans where the raw reading differs from the state
+
+        next_scan = monotonic()
+        while True:
+            key = 0
+            for row in rows:
+                row.on()
+                readings = [int(column.value) for column in columns]
+                row.off()
+
+                for reading in readings:
+                    if reading != states[key]:
+                        counters[key] += 1
+                        if counters[key] >= debounce_scans:
+                            states[key] = reading
+                            counters[key] = 0
+                            self.log(f"Matrix key {keys[key]} : {reading}")
+                            self.send_data(("matrix", keys[key], "button_event", reading))
+                    else:
+                        counters[key] = 0
+                    key += 1
+
+            next_scan += period
+            now = monotonic()
+            if next_scan <= now:  # too late, don't try to catch up
+                next_scan = now + period
+            sleep(next_scan - now)
 
     def get_input_device(self, device):
         """
@@ -86,6 +248,6 @@ class Mixin:
 
 
     def event_button(self, button):
-        pin = self.pins[self.buttons.index(button)]
+        pin = self.registry[id(button)][1]
         self.log(f"Button{pin}")
         self.send_data(("button", pin, "button_event", 1))
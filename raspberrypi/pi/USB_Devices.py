@@ -1,7 +1,82 @@
 from threading import Thread
+from time import monotonic
+
+# Linux input constants (linux/input-event-codes.h), same values as evdev.ecodes
+EV_SYN = 0
+EV_KEY = 1
+EV_REL = 2
+SYN_REPORT = 0
+REL_X = 0
+REL_Y = 1
+REL_WHEEL = 8
+
+# Usual name of the codes evdev knows under several names, the ones the configuration UI lists (KEY_MUTE, KEY_HANGUEL)
+# or the rules match (BTN_LEFT, BTN_X), instead of the first alias in alphabetical order (KEY_MIN_INTERESTING, BTN_NORTH)
+PREFERRED_NAMES = {"KEY_MUTE", "KEY_HANGUEL", "KEY_COFFEE", "KEY_DIRECTION", "KEY_BRIGHTNESS_ZERO", "KEY_WIMAX",
+                   "KEY_ZOOM", "KEY_SCREEN", "KEY_BRIGHTNESS_TOGGLE",
+                   "BTN_0", "BTN_LEFT", "BTN_TRIGGER", "BTN_A", "BTN_B", "BTN_X", "BTN_Y", "BTN_TOOL_PEN",
+                   "BTN_GEAR_DOWN", "BTN_TRIGGER_HAPPY1"}
 
 
 class Mixin:
+    def set_reader_mode(self, mode):
+        """
+        Choose how USB devices are read. Call it before adding USB devices.
+
+        :param mode: "threads" (one thread per device) or "asyncio" (every device read by one event loop in a single thread).
+        """
+        if mode not in ("threads", "asyncio"):
+            raise Exception(f"Unknown reader mode : {mode}")
+        self.reader_mode = mode
+        self.log(f"USB reader mode : {mode}")
+
+    def start_reader(self, loop_target, async_target, *args):
+        """
+        Start reading a device, in its own thread or on the shared event loop.
+
+        :param loop_target: blocking reading method, used in "threads" mode.
+        :param async_target: coroutine method, used in "asyncio" mode.
+        """
+        if self.reader_mode == "asyncio":
+            import asyncio
+
+            if self.reader_loop is None:
+                self.reader_loop = asyncio.new_event_loop()
+                loop_thread = Thread(name="USB Readers", target=self.reader_loop.run_forever)
+                loop_thread.start()
+
+            asyncio.run_coroutine_threadsafe(self.run_reader(async_target, *args), self.reader_loop)
+
+        else:
+            usb_device_thread = Thread(name="USB Device Reading", target=loop_target, args=args)
+            usb_device_thread.start()
+
+    async def run_reader(self, async_target, *args):
+        try:
+            await async_target(*args)
+        except Exception as error:  # one failing device must not stop the others
+            print(f"{self.term_fail}USB reader stopped : {error}{self.term_endc}")
+
+    def get_event_names(self):
+        """
+        Build once the (event type, code) -> name table used by every USB reader.
+        When evdev gives several names for a code, sorted alphabetically, the one of PREFERRED_NAMES is kept.
+        """
+        if self.event_names is None:
+            from evdev import ecodes
+
+            names = {}
+            for event_type, codes in ecodes.bytype.items():
+                for code, name in codes.items():
+                    if type(name) in (list, tuple):
+                        name = next((alias for alias in name if alias in PREFERRED_NAMES), name[0])
+                    names[(event_type, code)] = name
+
+            self.event_names = names
+            self.log(f"{len(names)} evdev event names indexed")
+
+        return self.event_names
+
     def add_generic_USB_device(self, input_number, device_name):
 
         if "mouse" in device_name or "keyboard" in device_name or "gamepad" in device_name:
@@ -15,26 +90,40 @@ class Mixin:
             print(f"{self.term_fail}USB Device {input_number} doesn't exist. Skipped.{self.term_endc}")
             return
         self.usb_devices.append("generic_usb_"+device_name)
+        self.register_device(usb, "USB", "generic_usb_"+device_name, device_name)
         self.usb_channels.append(input_number)
 
         self.log(f"Generic USB Device {'generic_usb_'+device_name} added with input{input_number}")
 
-        usb_device_thread = Thread(name="USB Device Reading", target=self.generic_usb_device_loop, args=(usb, device_name))
-        usb_device_thread.start()
+        self.get_event_names()
+        self.start_reader(self.generic_usb_device_loop, self.generic_usb_device_async, usb, device_name)
 
     def generic_usb_device_loop(self, usb, device_name):
-        from evdev import categorize, ecodes
-
         for event in usb.read_loop():
-            try:
+            self.handle_generic_usb_event(device_name, event)
+
+    async def generic_usb_device_async(self, usb, device_name):
+        async for event in usb.async_read_loop():
+            self.handle_generic_usb_event(device_name, event)
+
+    def handle_generic_usb_event(self, device_name, event):
+        if event.type == EV_SYN:  # only delimits frames
+            return
+
+        name = self.event_names.get((event.type, event.code))
+        if name is None:
+            self.log(f"{self.term_warning}Unknown event {event.type}:{event.code} from {device_name}{self.term_endc}")
+            name = f"{event.type}_{event.code}"
 
-                self.send_data(["USB", f"generic_usb_{device_name}", list(ecodes.ecodes)[list(ecodes.ecodes.values()).index(event.code)], event.value])
+        self.send_data(["USB", f"generic_usb_{device_name}", name, event.value], captured=event.timestamp())
 
-            except Exception as error:
-                print(error)
-                print("during USB (need debug)")
+    def add_USB_mouse(self, input_number, motion_tick=0):
+        """
+        Add a USB mouse. Relative motion is summed and sent as one "motion" event carrying [dx, dy].
 
-    def add_USB_mouse(self, input_number):
+        :param input_number: number of the /dev/input/event device.
+        :param motion_tick: 0 to send motion once per evdev frame (SYN_REPORT), or a minimum time in seconds between two motion events.
+        """
         from evdev import InputDevice
 
         try:
@@ -45,10 +134,11 @@ class Mixin:
             return
 
         self.usb_devices.append(f"mouse_{input_number}")
+        self.register_device(USB_mouse, "USB", f"mouse_{input_number}", "mouse")
         self.log(f"USB Mouse added with input{input_number}")
 
-        usb_device_thread = Thread(name="USB Device Reading", target=self.usb_mouse_read_events, args=(USB_mouse, input_number))
-        usb_device_thread.start()
+        self.get_event_names()
+        self.start_reader(self.usb_mouse_read_events, self.usb_mouse_async, USB_mouse, input_number, motion_tick)
 
     def add_USB_keyboard(self, input_number):
         from evdev import InputDevice
@@ -60,34 +150,118 @@ class Mixin:
             return
 
         self.usb_devices.append(f"keyboard_{input_number}")
+        self.register_device(USB_keyboard, "USB", f"keyboard_{input_number}", "keyboard")
         self.log(f"USB Mouse added with input{input_number}")
 
-        usb_device_thread = Thread(name="USB Device Reading", target=self.usb_keyboard_read_events, args=(USB_keyboard, input_number))
-        usb_device_thread.start()
+        self.get_event_names()
+        self.start_reader(self.usb_keyboard_read_events, self.usb_keyboard_async, USB_keyboard, input_number)
 
-    def usb_mouse_read_events(self, mouse, input_number):
-        from evdev import categorize, ecodes
+    def usb_mouse_read_events(self, mouse, input_number, motion_tick=0):
+        from select import select
 
-        for event in mouse.read_loop():
+        name = f"mouse_{input_number}"
+        state = {"motion": [0, 0], "last": 0, "tick": motion_tick, "captured": None}
 
-            if event.code == 8:
-                self.send_data(("USB", f"mouse_{input_number}", "scroll", event.value))
+        while True:
+            if not select([mouse.fd], [], [], self.mouse_timeout(state))[0]:  # tick elapsed without new event
+                self.flush_mouse_tick(name, state)
+                continue
 
-            elif event.code <= 1:
-                self.send_data(("USB", f"mouse_{input_number}", ecodes.REL[event.code], event.value))
+            try:
+                events = list(mouse.read())
+            except BlockingIOError:
+                continue
+
+            for event in events:
+                self.handle_mouse_event(name, state, event)
+
+    async def usb_mouse_async(self, mouse, input_number, motion_tick=0):
+        import asyncio
+
+        name = f"mouse_{input_number}"
+        state = {"motion": [0, 0], "last": 0, "tick": motion_tick, "captured": None}
+        pending = None
+
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(mouse.async_read())
+
+            done, _ = await asyncio.wait({pending}, timeout=self.mouse_timeout(state))
+            if not done:  # tick elapsed without new event, the read stays pending
+                self.flush_mouse_tick(name, state)
+                continue
+
+            events = pending.result()
+            pending = None
+            for event in events:
+                self.handle_mouse_event(name, state, event)
+
+    def mouse_timeout(self, state):
+        motion = state["motion"]
+        if state["tick"] and (motion[0] or motion[1]):
+            return max(0, state["last"] + state["tick"] - monotonic())
+        return None
+
+    def flush_mouse_tick(self, name, state):
+        self.send_mouse_motion(name, state)
+        state["last"] = monotonic()
+
+    def handle_mouse_event(self, name, state, event):
+        motion = state["motion"]
+
+        if event.type == EV_REL:
+            if event.code == REL_X or event.code == REL_Y:
+                if not (motion[0] or motion[1]):
+                    state["captured"] = event.timestamp()  # the accumulated motion is as old as its first delta
+                motion[event.code] += event.value
+
+            elif event.code == REL_WHEEL:
+                self.send_mouse_motion(name, state)
+                self.send_data(("USB", name, "scroll", event.value), continuous=True, captured=event.timestamp())
 
             else:
-                try:
-                    self.send_data(("USB", f"mouse_{input_number}", ecodes.BTN[event.code], event.value))
-                except Exception as error:
-                    print(error)
-                    print(self.term_fail, "not supported for the moment :", event.code, self.term_endc)
+                self.send_mouse_motion(name, state)
+                self.send_data(("USB", name, self.event_names.get((event.type, event.code), f"REL_{event.code}"), event.value), continuous=True, captured=event.timestamp())
 
+        elif event.type == EV_KEY:
+            self.send_mouse_motion(name, state)  # the pointer must be in place before the click
+            button = self.event_names.get((event.type, event.code))
+            if button is None:
+                print(self.term_fail, "not supported for the moment :", event.code, self.term_endc)
+            else:
+                self.send_data(("USB", name, button, event.value), captured=event.timestamp())
 
-    def usb_keyboard_read_events(self, keyboard, input_number):
-        from evdev import categorize, ecodes
+        elif event.type == EV_SYN and event.code == SYN_REPORT:
+            if not state["tick"] or monotonic() - state["last"] >= state["tick"]:
+                if self.send_mouse_motion(name, state):
+                    state["last"] = monotonic()
+
+    def send_mouse_motion(self, name, state):
+        """
+        Send the accumulated motion and reset it.
 
+        :param state: reading state of the mouse, its "motion" [dx, dy] is modified in place.
+        :return: True if something was sent.
+        """
+        motion = state["motion"]
+        if not (motion[0] or motion[1]):
+            return False
+
+        self.send_data(("USB", name, "motion", [motion[0], motion[1]]), continuous=True, captured=state["captured"])
+        motion[0] = 0
+        motion[1] = 0
+        return True
+
+    def usb_keyboard_read_events(self, keyboard, input_number):
         for event in keyboard.read_loop():
-            if event.type == ecodes.EV_KEY:
-                self.send_data(("USB", f"keyboard_{input_number}", ecodes.KEY[event.code], event.value))
-                self.log(f"{categorize(event)}")
+            self.handle_keyboard_event(input_number, event)
+
+    async def usb_keyboard_async(self, keyboard, input_number):
+        async for event in keyboard.async_read_loop():
+            self.handle_keyboard_event(input_number, event)
+
+    def handle_keyboard_event(self, input_number, event):
+        if event.type == EV_KEY:
+            key = self.event_names.get((event.type, event.code), f"KEY_{event.code}")
+            self.send_data(("USB", f"keyboard_{input_number}", key, event.value), captured=event.timestamp())
+            self.log(f"{key} : {event.value}")
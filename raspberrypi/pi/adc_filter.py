@@ -0,0 +1,78 @@
+"""
+Noise filtering for the ADC channels, every channel is kept in the same NumPy arrays.
+"""
+
+
+class ADCFilter:
+    def __init__(self, channels, mode="ema", size=5, alpha=0.3, deadband=2.0, max_value=255):
+        """
+        :param channels: number of channels.
+        :param mode: "ema" (exponential moving average), "median" (median of the last size samples) or "none".
+        :param size: length of the ring buffer of each channel.
+        :param alpha: weight of the newest sample for "ema".
+        :param deadband: a value is emitted only when it moved by at least this many percent since the last emitted one.
+        :param max_value: raw value read at 100 %.
+        """
+        import numpy
+
+        if mode not in ("ema", "median", "none"):
+            raise Exception(f"Unknown ADC filter : {mode}")
+
+        self.np = numpy
+        self.mode = mode
+        self.size = size
+        self.alpha = alpha
+        self.deadband = deadband
+        self.scale = 100 / max_value
+
+        self.buffer = numpy.full((channels, size), numpy.nan)
+        self.positions = numpy.zeros(channels, dtype=int)
+        self.average = numpy.full(channels, numpy.nan)
+        self.emitted = numpy.full(channels, numpy.nan)
+
+    def prime(self, channels, raw_values):
+        """
+        Load the first readings without emitting them.
+        """
+        self.update(channels, raw_values)
+
+    def update(self, channels, raw_values):
+        """
+        Add one sample to each given channel.
+
+        :param channels: list of channel numbers.
+        :param raw_values: raw readings, same order as channels.
+        :return: list of (channel, percent) that crossed the deadband or reached 0 or 100.
+        """
+        np = self.np
+        channels = np.asarray(channels)
+        values = np.asarray(raw_values, dtype=float) * self.scale
+
+        self.buffer[channels, self.positions[channels]] = values
+        self.positions[channels] = (self.positions[channels] + 1) % self.size
+
+        # A reading at a rail is exact, sent as is so the filter and the deadband never leave the value at 1 or 99
+        at_rail = (values <= 0) | (values >= 100)
+        filtered = np.where(at_rail, values, self.filtered(channels, values))
+
+        emitted = self.emitted[channels]
+        rounded = np.round(filtered)
+        settled = ((rounded == 0) | (rounded == 100)) & (rounded != np.round(emitted))
+        emit = np.isnan(emitted) | (np.abs(filtered - emitted) >= self.deadband) | settled
+        self.emitted[channels[emit]] = filtered[emit]
+
+        return [(int(channel), int(round(value))) for channel, value in zip(channels[emit], filtered[emit])]
+
+    def filtered(self, channels, values):
+        np = self.np
+
+        if self.mode == "ema":
+            previous = self.average[channels]
+            average = np.where(np.isnan(previous), values, self.alpha * values + (1 - self.alpha) * previous)
+            self.average[channels] = average
+            return average
+
+        elif self.mode == "median":
+            return np.nanmedian(self.buffer[channels], axis=1)
+
+        return values
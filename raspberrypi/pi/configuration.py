@@ -1,9 +1,13 @@
 from gpiozero import LED
-from os import getcwd, chdir, path
-from json import loads
+from json import dumps, loads
+from os import makedirs, path
+from requests import codes
 from signal import pause
 from threading import Thread
-from subprocess import run
+from time import monotonic, sleep
+
+from .server_pi.wsgi_https import PairingServer
+from .discovery import DiscoveryResponder, probe
 
 
 class Mixin:
@@ -24,62 +28,201 @@ class Mixin:
 
         if self.connection_mode == "WiFi":
 
-            if self.verbose:
-                log_level = ' -v'
-            else:
-                log_level = ''
-
             if timeout:
                 self.ready = False
                 self.log(f"{self.term_fail}Timeout!{self.term_endc}")
 
-            self.log(f"{self.term_warning}[WAITING] Connection from Driver{self.term_endc}")
+            self.start_discovery()
+            self.pair()
+            self.start_session()
+            self.replay_offline()  # events read before the driver connected
+            self.start_heartbeat()
 
-            led = Thread(name='Connection Blink LED', target=self.show_connection)
-            led.start()
+            pause()
 
-            old_cwd = getcwd()
+        elif self.connection_mode == "BT":
+            print(self.term_fail, "Bluetooth unsupported", self.term_endc)
 
-            chdir(path.join("pi", "server_pi"))
-            run(f"/usr/bin/python3 wsgi_https.py{log_level}".split())
-            chdir(old_cwd)
+    def pair(self):
+        """
+        Wait until the driver connects.
+        """
+        self.log(f"{self.term_warning}[WAITING] Connection from Driver{self.term_endc}")
 
-            with open(path.join(self.config_folder, "connection.pi"), 'r', encoding="utf-8") as f:
-                content = loads(f.read())
-                self.code = content["code"]
-                self.driver_platform = content["platform"]
-                self.log("\n Connection code : " + self.term_header + str(self.code) + self.term_endc)
+        led = Thread(name='Connection Blink LED', target=self.show_connection)
+        led.start()
 
-            self.server_url = "https://" + self.server_url
-            self.log(self.server_url)
-            self.log(self.driver_platform)
+        self.discover_driver()
 
-            self.ready = True
-            self.send_inventory()
+        delay = self.pairing_poll_interval
+        while not self.recover_connection(delay):
+            delay = min(delay * 2, self.reconnect_max_backoff)
 
-            ping_thread = Thread(name="Ping server", target=self.ping_server)
-            ping_thread.start()
+    def recover_connection(self, timeout):
+        """
+        One attempt to get a session : resume the previous one if the driver still accepts the current code,
+        else wait up to timeout seconds for the driver to pair again.
 
-            pause()
+        :return: True once connected.
+        """
+        if self.code and self.resume_session():
+            self.stop_pairing_server()
+            return True
+
+        if self.pairing_server is None:
+            self.pairing_server = PairingServer(verbose=self.verbose)
+            self.pairing_server.start()
+
+        pairing = self.pairing_server.wait(timeout)
+        if pairing is None:
+            return False
+
+        self.stop_pairing_server()
+        self.code = pairing["code"]
+        self.session_key = pairing["key"]
+        self.driver_platform = pairing["platform"]
+        self.set_driver_address(pairing["ip"])
+        self.save_last_driver()
+        self.log("\n Connection code : " + self.term_header + str(self.code) + self.term_endc)
+        self.log(self.driver_platform)
+        return True
+
+    def load_last_driver(self):
+        """
+        Use the address, code and key of the last session if the Pi was started without the driver's IP.
+        """
+        try:
+            with open(path.join(self.config_folder, "driver.pi"), 'r', encoding="utf-8") as f:
+                last_driver = loads(f.read())
+        except (OSError, ValueError):
+            return
+
+        self.code = last_driver["code"]
+        self.session_key = last_driver.get("key")
+        if self.ip is None:
+            self.ip = last_driver["ip"]
+
+    def save_last_driver(self):
+        try:
+            makedirs(self.config_folder, exist_ok=True)
+            with open(path.join(self.config_folder, "driver.pi"), 'w', encoding="utf-8") as f:
+                f.write(dumps({"ip": self.ip, "code": self.code, "key": self.session_key}))
+        except OSError as error:
+            self.log(f"{self.term_warning}Driver's address not saved : {error}{self.term_endc}")
+
+    def set_driver_address(self, ip):
+        if ip == self.ip:
+            return
+
+        self.log(f"{self.term_warning}Driver's address changed : {self.ip} -> {ip}{self.term_endc}")
+        self.ip = ip
+        self.server_url = f'https://{self.ip}:9876/action'
+        self.reset_session()
+        self.save_last_driver()
+
+    def start_discovery(self):
+        """
+        Answer the driver's probes so it finds the Pi after an address change, they are signed with the session key.
+        The driver's address is not taken from its probes, it is learnt when it pairs or when it answers discover_driver.
+        """
+        if self.discovery is None:
+            self.discovery = DiscoveryResponder("pi", lambda: self.session_key, verbose=self.verbose)
+            self.discovery.start()
 
-        elif self.connection_mode == "BT":
-            print(self.term_fail, "Bluetooth unsupported", self.term_endc)
+    def discover_driver(self, timeout=1):
+        """
+        Look for the driver on the LAN with the current session key.
+        """
+        if not self.session_key:
+            return
 
-    def send_inventory(self):
-        inventory = {"GPIO_buttons": []}
+        ip = probe(self.session_key, "pi", timeout=timeout)
+        if ip is not None:
+            self.set_driver_address(ip)
+
+    def stop_pairing_server(self):
+        if self.pairing_server is not None:
+            self.pairing_server.stop()
+            self.pairing_server = None
+
+    def resume_session(self, timeout=None):
+        """
+        :return: True if the driver still accepts the current connection code.
+        """
+        try:
+            r = self.post(dumps({"code": self.code, "request": {"type": "ping"}}), timeout=timeout)
+        except Exception:
+            return False
 
-        for b in self.buttons:
-            pin = self.pins[self.buttons.index(b)]
-            inventory["GPIO_buttons"].append(pin)
+        if r.status_code != codes.ok:
+            return False
 
-        if self.ADC_channels != 0:
-            inventory.update({"ADC_channels": self.ADC_channels})
+        self.log(f"{self.term_ok_green}Session resumed{self.term_endc}")
+        return True
 
-        if self.usb_devices:
-            inventory.update({"USB": self.usb_devices})
+    def wait_for_driver(self, timeout=10):
+        """
+        The driver starts its LAN server once the pairing request returned,
+        wait until it answers so the wire negotiation and the inventory don't hit a closed port.
+
+        :return: False if the driver didn't answer before the timeout.
+        """
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if self.ping_server(min(1, timeout)):
+                return True
+            sleep(0.1)
+
+        self.log(f"{self.term_warning}The driver doesn't answer yet{self.term_endc}")
+        return False
+
+    def start_session(self):
+        self.ready = True
+        self.wait_for_driver()
+        self.negotiate_wire()
+        self.open_stream()
+        self.open_datagram()
+        self.send_inventory()
+
+    def register_device(self, device, device_type, device_id, name):
+        """
+        Index a device so its callbacks get (device type, id, name) with one dictionary lookup.
 
-        if self.gamepads:
-            inventory.update({"gamepad": len(self.gamepads)})
+        :param device: the object passed to the callbacks (gpiozero Button, xbox360controller Button or Axis, evdev InputDevice),
+                       or a tuple key for devices without object (ADC channels).
+        """
+        if type(device) == tuple:
+            self.registry[device] = (device_type, device_id, name)
+        else:
+            self.registry[id(device)] = (device_type, device_id, name)
+            self.registry_objects.append(device)  # keeps the object alive, its id can't be reused
+
+    def send_inventory(self):
+        inventory = {"GPIO_buttons": []}
+        usb = []
+        gamepads = set()
+        ADC_channels = 0
+
+        for device_type, device_id, name in self.registry.values():
+            if device_type == "button":
+                inventory["GPIO_buttons"].append(device_id)
+            elif device_type == "USB":
+                usb.append(device_id)
+            elif device_type == "gamepad":
+                gamepads.add(device_id)
+            elif device_type == "ADC":
+                ADC_channels = max(ADC_channels, device_id)
+            elif device_type == "matrix":
+                inventory.setdefault("matrix_keys", []).append(device_id)
+
+        if ADC_channels != 0:
+            inventory.update({"ADC_channels": ADC_channels})
+
+        if usb:
+            inventory.update({"USB": usb})
+
+        if gamepads:
+            inventory.update({"gamepad": len(gamepads)})
 
         if self.debug_inventory:  # TEMPORARY
             self.log("Debug inventory selected")
@@ -16,10 +16,12 @@ class Mixin:
             with Xbox360Controller(index, raw_mode=True) as controller:
                 self.log("configuring gamepad", index)
                 for b in controller.buttons:
+                    self.register_device(b, "gamepad", index, b.name)
                     b.when_pressed = self.on_button_pressed
                     self.gamepads[index].append(b)
 
                 for a in controller.axes:
+                    self.register_device(a, "gamepad", index, a.name)
                     a.when_moved = self.on_axis_moved_raw
                     self.gamepads[index].append(a)
 
@@ -29,26 +31,16 @@ class Mixin:
             print(f"{self.term_fail}No USB Controller connected. Skipped. \nError : {error}{self.term_endc}")
 
     def on_button_pressed(self, button):
-        i = 0
-        for c in self.gamepads:
+        device_type, index, name = self.registry[id(button)]
 
-            if button in c:
-                pin = i
-                break
-            i += 1
+        self.log(f'Button {name} was pressed.')
 
-        self.log(f'Button {button.name} was pressed.')
-
-        self.send_data(("gamepad", pin, button.name, 1))
+        self.send_data((device_type, index, name, 1))
 
     def on_axis_moved_raw(self, axis):
-        i = 0
-        for c in self.gamepads:
-            if axis in c:
-                pin = i
-                break
+        device_type, index, name = self.registry[id(axis)]
 
         value = axis.value
-        self.log(f"Axis {axis.name} moved to {value}")
+        self.log(f"Axis {name} moved to {value}")
 
-        self.send_data(("gamepad", pin, axis.name, round(value, 2)))
+        self.send_data((device_type, index, name, round(value, 2)), continuous=True, sampled=True)
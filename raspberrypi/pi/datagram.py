@@ -0,0 +1,47 @@
+"""
+UDP sender for sampled streams (ADC channels, gamepad axes), see driver/driver/lan_server/datagram_server.py.
+Datagrams are numbered and signed with the session key, the driver drops the stale ones.
+Each sender draws a random epoch so the driver knows the numbering started again after a reconnection.
+"""
+import hmac
+import socket
+from hashlib import sha256
+from json import dumps
+from secrets import randbits
+from struct import Struct
+from threading import Lock
+
+MAGIC = 0xA6
+VERSION = 2
+HEADER = Struct("<BBIQ")
+MAC_SIZE = 16
+
+
+class DatagramSender:
+    def __init__(self, host, port, key):
+        self.address = (host, port)
+        self.key = str(key).encode()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.epoch = randbits(32)
+        self.sequence = 0
+        self.lock = Lock()
+        self.sent = 0
+
+    def send(self, request):
+        """
+        :param request: {"type", "id", "event_type", "value"} dictionary.
+        :raise OSError: if the datagram couldn't be sent.
+        """
+        payload = dumps(request, separators=(',', ':')).encode()
+
+        with self.lock:
+            self.sequence += 1
+            data = HEADER.pack(MAGIC, VERSION, self.epoch, self.sequence) + payload
+
+        data += hmac.new(self.key, data, sha256).digest()[:MAC_SIZE]
+        self.socket.sendto(data, self.address)
+        self.sent += 1
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,172 @@
+"""
+Find the driver on the LAN when its address changed.
+Copy of driver/driver/lan_server/discovery.py, the reference, only this docstring differs (utility/check_copies.py).
+
+A message is : magic (B), version (B), JSON body, HMAC-SHA256 of everything before it (16 bytes).
+The HMAC key is the session key sent by the driver over TLS when pairing (128 bits, the connection code is too short
+to resist an offline search), so only a Pi and a driver that were paired together answer each other.
+
+    probe  : {"type": "probe", "role": sender's role, "nonce": ...}, broadcast
+    answer : {"type": "answer", "role": sender's role, "nonce": nonce of the probe}, sent back to the prober
+
+Messages carry no time, a Pi on an offline LAN has no NTP and its clock can be hours off. An answer is bound to the
+nonce of the probe, and a replayed probe only proposes an address that the peer still has to confirm over TLS.
+"""
+import hmac
+import socket
+import threading
+from hashlib import sha256
+from json import dumps, loads
+from os import urandom
+from time import monotonic
+
+DISCOVERY_PORT = 9879
+
+MAGIC = 0xA7
+VERSION = 2
+MAC_SIZE = 16
+SEEN_TTL = 60  # seconds a probe's nonce is remembered, the same probe isn't answered twice meanwhile
+
+
+def sign(key, data):
+    return hmac.new(str(key).encode(), data, sha256).digest()[:MAC_SIZE]
+
+
+def pack(key, body):
+    data = bytes([MAGIC, VERSION]) + dumps(body).encode()
+    return data + sign(key, data)
+
+
+def unpack(key, data):
+    """
+    :return: the body, None if the message isn't signed with this key.
+    """
+    if len(data) < 2 + MAC_SIZE or data[0] != MAGIC or data[1] != VERSION:
+        return None
+
+    signed, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+    if not hmac.compare_digest(sign(key, signed), mac):
+        return None
+
+    return loads(signed[2:])
+
+
+def probe(key, role, port=DISCOVERY_PORT, timeout=1, attempts=3):
+    """
+    Broadcast a probe and wait for the peer paired with this session key.
+
+    :param role: "driver" or "pi", role of the prober.
+    :return: the peer's IP, None if nobody answered.
+    """
+    nonce = urandom(8).hex()
+    message = pack(key, {"type": "probe", "role": role, "nonce": nonce})
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as prober:
+        prober.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        deadline = monotonic() + timeout
+
+        for attempt in range(attempts):
+            prober.sendto(message, ("<broadcast>", port))
+            attempt_deadline = min(deadline, monotonic() + timeout / attempts)
+
+            while True:
+                remaining = attempt_deadline - monotonic()
+                if remaining <= 0:
+                    break
+                prober.settimeout(remaining)
+                try:
+                    data, address = prober.recvfrom(2048)
+                except socket.timeout:
+                    break
+
+                try:
+                    body = unpack(key, data)
+                except ValueError:
+                    continue
+                if body is not None and body["type"] == "answer" and body["nonce"] == nonce and body["role"] != role:
+                    return address[0]
+
+    return None
+
+
+class DiscoveryResponder:
+    def __init__(self, role, get_key, on_probe=None, port=DISCOVERY_PORT, verbose=False):
+        """
+        Answer the probes of the paired peer.
+
+        :param role: "driver" or "pi".
+        :param get_key: function returning the current session key, None if not paired.
+        :param on_probe: called with the peer's IP when it sends a valid probe. A probe can be replayed from
+                         another address, so the IP must only be trusted once the peer authenticates over TLS.
+        """
+        self.role = role
+        self.get_key = get_key
+        self.on_probe = on_probe
+        self.port = port
+        self.verbose = verbose
+
+        self.seen = {}
+        self.answered = 0
+        self.rejected = 0
+
+        self.socket = None
+        self.running = False
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('0.0.0.0', self.port))
+        self.running = True
+
+        listener = threading.Thread(name="Discovery", target=self.receive_loop, daemon=True)
+        listener.start()
+        self.log(f"Discovery listening on {self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.socket is not None:
+            self.socket.close()
+
+    def receive_loop(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except OSError:
+                break
+
+            try:
+                self.handle(data, address)
+            except Exception as error:
+                self.rejected += 1
+                self.log(f"Discovery message from {address[0]} rejected : {error}")
+
+    def handle(self, data, address):
+        key = self.get_key()
+        if not key:
+            return
+
+        body = unpack(key, data)
+        if body is None or body["type"] != "probe" or body["role"] == self.role:
+            self.rejected += 1
+            return
+
+        now = monotonic()
+        self.seen = {nonce: seen for nonce, seen in self.seen.items() if now - seen < SEEN_TTL}
+        if body["nonce"] in self.seen:  # replayed probe
+            self.rejected += 1
+            return
+        self.seen[body["nonce"]] = now
+
+        self.socket.sendto(pack(key, {"type": "answer", "role": self.role, "nonce": body["nonce"]}), address)
+        self.answered += 1
+        self.log(f"Discovery probe answered : {address[0]}")
+
+        if self.on_probe is not None:
+            self.on_probe(address[0])
+
+    def stats(self):
+        return {"answered": self.answered, "rejected": self.rejected}
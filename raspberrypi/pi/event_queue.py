@@ -0,0 +1,95 @@
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+from queue import Empty
+
+
+class EventQueue:
+    def __init__(self, max_size=256, policy="drop_oldest", workers=1):
+        """
+        Bounded queue shared by the sender workers.
+        Each device is always given to the same worker, so its events keep their order.
+
+        :param max_size: maximum number of events waiting in each worker queue.
+        :param policy: "block", "drop_oldest" or "drop_newest", what to do when a worker queue is full.
+        :param workers: number of sender workers.
+        """
+        if policy not in ("block", "drop_oldest", "drop_newest"):
+            raise Exception(f"Unknown overflow policy : {policy}")
+
+        self.max_size = max_size
+        self.policy = policy
+        self.workers = workers
+
+        self.queues = [deque() for _ in range(workers)]
+        self.conditions = [Condition(Lock()) for _ in range(workers)]
+
+        self.dropped = 0
+        self.max_depth = 0
+
+    def worker_index(self, key):
+        return hash(key) % self.workers
+
+    def put(self, key, item, timeout=None):
+        """
+        Add an event to the queue of the worker in charge of this device.
+
+        :param key: device key, for example ("USB", "mouse_3").
+        :param item: event to send.
+        :param timeout: only used with the "block" policy.
+        :return: False if the event was dropped.
+        """
+        index = self.worker_index(key)
+        events = self.queues[index]
+        condition = self.conditions[index]
+
+        with condition:
+            if len(events) >= self.max_size:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+
+                elif self.policy == "drop_oldest":
+                    events.popleft()
+                    self.dropped += 1
+
+                else:
+                    if not condition.wait_for(lambda: len(events) < self.max_size, timeout):
+                        self.dropped += 1
+                        return False
+
+            events.append(item)
+            if len(events) > self.max_depth:
+                self.max_depth = len(events)
+            condition.notify_all()
+            return True
+
+    def get(self, index, timeout=None):
+        """
+        Wait for the next event of a worker.
+
+        :raise queue.Empty: if nothing arrived before timeout.
+        """
+        events = self.queues[index]
+        condition = self.conditions[index]
+
+        with condition:
+            if timeout is None:
+                condition.wait_for(lambda: len(events) > 0)
+            else:
+                deadline = monotonic() + timeout
+                while not events:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    condition.wait(remaining)
+
+            item = events.popleft()
+            condition.notify_all()
+            return item
+
+    def depth(self):
+        return sum(len(events) for events in self.queues)
+
+    def stats(self):
+        return {"depth": self.depth(), "max_depth": self.max_depth, "dropped": self.dropped, "policy": self.policy, "workers": self.workers}
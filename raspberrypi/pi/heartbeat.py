@@ -0,0 +1,134 @@
+"""
+Watch the connection with the driver and reconnect when it is lost.
+
+    connected    : the driver answers.
+    degraded     : some heartbeats were missed, events are still sent.
+    reconnecting : too many heartbeats missed, events are not sent until the connection is back.
+"""
+from threading import Event, Lock, Thread
+from time import monotonic
+
+CONNECTED = "connected"
+DEGRADED = "degraded"
+RECONNECTING = "reconnecting"
+
+
+class Heartbeat:
+    def __init__(self, ping, reconnect, interval=1, misses=3, max_backoff=30, log=print, on_recovered=None):
+        """
+        :param ping: called with a timeout in seconds, returns True if the driver answered.
+        :param reconnect: called with a timeout in seconds, returns True once the driver accepts the Pi again.
+        :param interval: time in seconds between two heartbeats, can be less than a second.
+        :param misses: number of heartbeats missed in a row before reconnecting.
+        :param max_backoff: maximum time in seconds between two reconnection attempts.
+        :param on_recovered: called once the state is connected again, to restart the session.
+        """
+        self.ping = ping
+        self.reconnect = reconnect
+        self.interval = interval
+        self.misses = misses
+        self.max_backoff = max_backoff
+        self.log = log
+        self.on_recovered = on_recovered
+
+        self.state = CONNECTED
+        self.missed = 0
+        self.last_answer = monotonic()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+        self.outages = 0
+        self.outage_started = None
+        self.last_recovery = 0
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = Thread(name="Heartbeat", target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def set_state(self, state):
+        if state != self.state:
+            previous, self.state = self.state, state
+            self.log(f"Connection {previous} -> {state}")
+
+    def report(self, answered):
+        """
+        Events sent by the Pi count as heartbeats : an answer resets the misses, a failure counts as a miss.
+        """
+        with self.lock:
+            if self.state == RECONNECTING:
+                return
+
+            if answered:
+                self.missed = 0
+                self.last_answer = monotonic()
+                self.set_state(CONNECTED)
+            else:
+                self.miss()
+
+    def miss(self):
+        self.missed += 1
+        if self.missed >= self.misses:
+            self.set_state(RECONNECTING)
+        else:
+            self.set_state(DEGRADED)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.state == RECONNECTING:
+                self.recover()
+                continue
+
+            if monotonic() - self.last_answer < self.interval:
+                continue  # an event was answered recently, no need to ping
+
+            answered = self.ping(self.interval)
+            with self.lock:
+                if self.state == RECONNECTING:
+                    continue
+                if answered:
+                    self.missed = 0
+                    self.last_answer = monotonic()
+                    self.set_state(CONNECTED)
+                else:
+                    self.miss()
+
+    def recover(self):
+        """
+        Try again with a delay doubling after each failure, in a loop so a long outage never grows the stack.
+        """
+        self.outages += 1
+        self.outage_started = monotonic()
+        delay = self.interval
+
+        while not self.stopped.is_set():
+            attempt = monotonic()
+            if self.reconnect(delay):
+                break
+
+            remaining = delay - (monotonic() - attempt)  # reconnect may fail before the timeout
+            if remaining > 0:
+                self.stopped.wait(remaining)
+            delay = min(delay * 2, self.max_backoff)
+
+        if self.stopped.is_set():
+            return
+
+        with self.lock:
+            self.last_recovery = monotonic() - self.outage_started
+            self.outage_started = None
+            self.missed = 0
+            self.last_answer = monotonic()
+            self.set_state(CONNECTED)
+        self.log(f"Connection recovered in {self.last_recovery:.3f} s")
+
+        if self.on_recovered is not None:
+            self.on_recovered()
+
+    def stats(self):
+        return {"state": self.state, "missed": self.missed, "outages": self.outages,
+                "last_recovery": self.last_recovery, "interval": self.interval, "misses": self.misses}
@@ -0,0 +1,85 @@
+"""
+Events kept while the driver can't be reached, replayed in order once the connection is back.
+
+Discrete events (buttons, keys) go in a bounded ring buffer and expire after a TTL.
+Sampled streams (gamepad axes, ADC) only keep their latest value.
+"""
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+
+class OfflineBuffer:
+    def __init__(self, max_size=512, ttl=10):
+        """
+        :param max_size: maximum number of discrete events kept, the oldest ones are dropped first.
+        :param ttl: time in seconds after which a discrete event is too old to be replayed.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.events = deque()
+        self.latest = {}
+        self.lock = Lock()
+
+        self.buffered = 0
+        self.replayed = 0
+        self.dropped = 0  # ring buffer full
+        self.expired = 0
+
+    @staticmethod
+    def stream(request):
+        return request["type"], request["id"], request["event_type"]
+
+    def add(self, request, sampled=False):
+        with self.lock:
+            self.buffered += 1
+            if sampled:
+                self.latest[self.stream(request)] = (monotonic(), request)
+                return
+
+            if len(self.events) >= self.max_size:
+                self.events.popleft()
+                self.dropped += 1
+            self.events.append((monotonic(), request))
+
+    def requeue(self, entries):
+        """
+        Put back entries returned by drain that couldn't be replayed, they keep their time so the TTL still applies.
+        Discrete events go before the ones buffered since, a sampled value only if no newer one was buffered.
+        """
+        with self.lock:
+            self.replayed -= len(entries)
+            for buffered_at, request, sampled in reversed(entries):
+                if sampled:
+                    self.latest.setdefault(self.stream(request), (buffered_at, request))
+                elif len(self.events) >= self.max_size:
+                    self.dropped += 1
+                else:
+                    self.events.appendleft((buffered_at, request))
+
+    def pending(self):
+        return len(self.events) + len(self.latest)
+
+    def drain(self):
+        """
+        :return: (buffered_at, request, sampled) to replay, discrete events in order then the latest value of each stream.
+        """
+        now = monotonic()
+        with self.lock:
+            entries = []
+            for buffered_at, request in self.events:
+                if now - buffered_at > self.ttl:
+                    self.expired += 1
+                else:
+                    entries.append((buffered_at, request, False))
+            entries.extend((buffered_at, request, True) for buffered_at, request in self.latest.values())
+
+            self.events.clear()
+            self.latest = {}
+            self.replayed += len(entries)
+            return entries
+
+    def stats(self):
+        return {"pending": self.pending(), "buffered": self.buffered, "replayed": self.replayed,
+                "dropped": self.dropped, "expired": self.expired, "max_size": self.max_size, "ttl": self.ttl}
@@ -9,8 +9,10 @@
 # You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from . import configuration, running, USB_Devices, controller_devices, GPIO_inputs
+from .offline_buffer import OfflineBuffer
 from urllib3 import disable_warnings as urllib_disable_warnings
 from os import getenv
+from threading import Lock
 
 urllib_disable_warnings()
 
@@ -27,7 +29,7 @@ class Pi(
         """
         Creates a Pi object.
 
-        :param ip: IP of the pc that runs the driver.
+        :param ip: IP of the pc that runs the driver, None to use the last known one (it is found again on the LAN if it changes).
         :param connection_mode: "WifI" : Only WiFi is functional for the moment.
         :param verbose: for development purposes only.
         """
@@ -60,13 +62,47 @@ class Pi(
         self.config_folder = getenv('HOME') + "/.config/RaspiMote/"
         self.log(f"Config folder : {self.config_folder}")
 
+        self.code = 0
+        self.session_key = None  # sent by the driver when pairing, signs the discovery messages and the datagrams
         self.ip = ip
+        self.load_last_driver()
         self.driver_platform = ''
-        self.log(f"Driver's IP : {ip}")
-
-        self.code = 0
-        self.server_url = f'{self.ip}:9876/action'
+        self.log(f"Driver's IP : {self.ip}")
+
+        self.server_url = f'https://{self.ip}:9876/action'
+        self.discovery = None
+        self.pairing_poll_interval = 1
+        self.pairing_server = None
+        self.heartbeat = None
+        self.heartbeat_interval = 1
+        self.heartbeat_misses = 3
+        self.reconnect_max_backoff = 30
+        self.offline_buffer = OfflineBuffer()
+        self.replay_lock = Lock()
         self.request_headers = {"Content-Type": "application/json"}
+        self.request_timeout = 5
+        self.session = None
+        self.session_lock = Lock()
+        self.session_pool_size = 4
+
+        self.event_queue = None
+        self.event_queue_lock = Lock()
+        self.batch_size = 32
+        self.batch_window = 0.003
+
+        self.wire_format = "json"
+        self.wire_encoder = None
+
+        self.transport = "https"
+        self.stream = None
+        self.stream_port = 9877
+        self.stream_connecting = None  # stream being connected by the background thread
+        self.stream_lock = Lock()
+        self.stream_max_backoff = 30
+
+        self.datagram_enabled = False
+        self.datagram = None
+        self.datagram_port = 9878
 
         self.display_info = False
         self.error_led = False
@@ -74,14 +110,23 @@ class Pi(
 
         self.ADC = None
         self.ADC_channels = 0
+        self.ADC_filter = None
+        self.ADC_filter_settings = {}  # ADCFilter defaults until configure_ADC_filter is called
 
         self.usb_devices = []
         self.usb_channels = []
+        self.reader_mode = "threads"
+        self.reader_loop = None
+        self.event_names = None
 
         self.gamepads = []
 
         self.buttons = []
         self.pins = []
+        self.matrices = []
+
+        self.registry = {}
+        self.registry_objects = []
 
     def log(self, message, newline=True):
         if self.verbose:
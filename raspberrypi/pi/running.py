@@ -1,32 +1,303 @@
 from threading import Thread
-from time import sleep, time
+from time import sleep, time, monotonic
+from queue import Empty
 import datetime
-from requests import post, codes
+from requests import Session, codes
+from requests.adapters import HTTPAdapter
 from json import dumps
 
+from .event_queue import EventQueue
+from . import wire
+from .stream import StreamChannel
+from .datagram import DatagramSender
+from .heartbeat import Heartbeat, CONNECTED, RECONNECTING
+from .offline_buffer import OfflineBuffer
+
 
 class Mixin:
-    def ping_server(self):
-        while True:
-            sleep(9)
-            if self.verbose:
-                start = time()
+    def new_session(self):
+        """
+        Create the keep-alive HTTPS session used to reach the driver.
+        Connections are pooled so each event reuses an open TLS connection instead of doing a new handshake.
+        """
+        session = Session()
+        session.verify = False
+        session.headers.update(self.request_headers)
+        session.headers.update({"Connection": "keep-alive"})
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.session_pool_size, max_retries=0, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        self.log(f"New HTTPS session (pool size : {self.session_pool_size})")
+        return session
 
-            content = dumps({"code": self.code, "request": {"type": "ping"}})
+    def get_session(self):
+        with self.session_lock:
+            if self.session is None:
+                self.session = self.new_session()
+            return self.session
+
+    def reset_session(self, session=None):
+        """
+        Drop the current session after a failure, the next request will open a new one.
+
+        :param session: the session that failed, ignored if another thread already replaced it.
+        """
+        with self.session_lock:
+            if self.session is None or (session is not None and session is not self.session):
+                return
             try:
-                post(self.server_url, data=content, headers=self.request_headers, verify=False)
-                if self.verbose:
-                    self.log(f"[PING] {self.term_ok_green}{str(time() - start)} s{self.term_endc}\n")
+                self.session.close()
             except Exception:
-                self.log(f"{self.term_fail}[FAIL] Retrying in 5s{self.term_endc}")
-                sleep(5)
+                pass
+            self.session = None
+            self.log(f"{self.term_warning}HTTPS session reset{self.term_endc}")
+
+    def post(self, content, url=None, headers=None, timeout=None):
+        if url is None:
+            url = self.server_url
+        if timeout is None:
+            timeout = self.request_timeout
+
+        session = self.get_session()
+        try:
+            return session.post(url, data=content, headers=headers, timeout=timeout)
+        except Exception:
+            self.reset_session(session)
+            raise
+
+    def set_wire_format(self, wire_format):
+        """
+        Choose how events are encoded.
+
+        :param wire_format: "json" (readable, for debugging) or "binary" (compact frames, used only if the driver supports it).
+        """
+        if wire_format not in ("json", "binary"):
+            raise Exception(f"Unknown wire format : {wire_format}")
+        self.wire_format = wire_format
+        self.log(f"Wire format : {wire_format}")
+
+    def negotiate_wire(self):
+        """
+        Ask the driver which binary versions it supports, this also resets its name tables.
+        Falls back to JSON if the driver is too old.
+        """
+        self.wire_encoder = None
+        if self.wire_format != "binary":
+            return
+
+        try:
+            r = self.post(dumps({"code": self.code, "reset": True}), self.server_url + "/wire")
+            versions = r.json()["versions"] if r.status_code == codes.ok else []
+        except Exception:
+            versions = []
+
+        if wire.VERSION in versions:
+            self.wire_encoder = wire.WireEncoder()
+            self.log(f"{self.term_ok_green}Binary wire format v{wire.VERSION} enabled{self.term_endc}")
+        else:
+            print(f"{self.term_warning}Driver doesn't support the binary format, using JSON.{self.term_endc}")
+
+    def send_wire_update(self, update):
+        r = self.post(dumps({"code": self.code, "tables": update}), self.server_url + "/wire")
+        if r.status_code != codes.ok:
+            raise Exception(f"Wire tables refused by the driver : {r.text}")
+
+    def encode_request(self, data, url):
+        """
+        :return: (content, url, headers) to post.
+        """
+        if self.wire_encoder is not None:
+            if "requests" in data:
+                requests = data["requests"]
+            else:
+                requests = [data["request"]]
+
+            if all("event_type" in request for request in requests):
+                try:
+                    frame = self.wire_encoder.encode(self.code, requests, self.send_wire_update)
+                    return frame, self.server_url + "/bin", {"Content-Type": "application/octet-stream"}
+                except ValueError as error:
+                    self.log(f"{self.term_warning}{error}, sent as JSON{self.term_endc}")
+
+        return dumps(data), url, None
+
+    def set_transport(self, transport, port=9877):
+        """
+        Choose how events reach the driver.
+
+        :param transport: "https" (one request per event or batch) or "stream" (one persistent TLS connection, falls back to HTTPS when down).
+        :param port: port of the driver's stream server.
+        """
+        if transport not in ("https", "stream"):
+            raise Exception(f"Unknown transport : {transport}")
+        self.transport = transport
+        self.stream_port = port
+        self.log(f"Transport : {transport}")
+
+    def open_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        if self.transport != "stream":
+            return
+
+        self.stream = StreamChannel(self.ip, self.stream_port, self.code, self.log)
+        self.connect_stream(self.stream)
+
+    def connect_stream(self, stream):
+        """
+        Connect in a background thread, a filtered port would otherwise stall the sender workers for the connect timeout.
+        Events use HTTPS until the stream is up.
+        """
+        with self.stream_lock:
+            if self.stream_connecting is stream:
+                return
+            self.stream_connecting = stream
+
+        Thread(name="Stream Connection", target=self.stream_connection_loop, args=[stream], daemon=True).start()
+
+    def stream_connection_loop(self, stream):
+        delay = 1
+        try:
+            while stream is self.stream and not stream.connected():
                 try:
-                    post(self.server_url, data=content, headers=self.request_headers, verify=False)
-                except Exception:
-                    self.log(f"{self.term_fail}[FAIL] Restarting connection procedure{self.term_endc}")
-                    break
-        self.server_url = f'{self.ip}:9876/action'
-        self.establish_connection()
+                    stream.connect()
+                    return
+                except Exception as error:
+                    self.log(f"{self.term_warning}Stream unavailable, using HTTPS : {error}{self.term_endc}")
+
+                sleep(delay)
+                delay = min(delay * 2, self.stream_max_backoff)
+        finally:
+            with self.stream_lock:
+                if self.stream_connecting is stream:
+                    self.stream_connecting = None
+
+    def send_stream(self, content):
+        """
+        :return: False if the event must be sent with HTTPS instead.
+        """
+        stream = self.stream
+        if stream is None:
+            return False
+
+        if not stream.connected():
+            self.connect_stream(stream)
+            return False
+
+        if type(content) == str:
+            content = content.encode()
+
+        try:
+            stream.send(content)
+            return True
+        except ConnectionError as error:
+            self.log(f"{self.term_warning}Stream lost : {error}{self.term_endc}")
+            stream.close()
+            self.connect_stream(stream)
+            return False
+
+    def set_datagram_mode(self, enabled=True, port=9878):
+        """
+        Send sampled streams (ADC channels, gamepad axes) over UDP, where a late value is worth less than a lost one.
+        Buttons, keys and mouse events always use the reliable transport.
+
+        :param port: port of the driver's datagram server.
+        """
+        self.datagram_enabled = enabled
+        self.datagram_port = port
+        self.log(f"UDP for sampled streams : {enabled}")
+
+    def open_datagram(self):
+        if self.datagram is not None:
+            self.datagram.close()
+            self.datagram = None
+
+        if self.datagram_enabled and self.session_key:
+            self.datagram = DatagramSender(self.ip, self.datagram_port, self.session_key)
+
+    def send_datagram(self, request):
+        """
+        :return: False if the sample must go through the queue instead.
+        """
+        if self.datagram is None or not self.ready or self.connection_state() == RECONNECTING:
+            return False
+
+        try:
+            self.datagram.send(request)
+            return True
+        except OSError as error:
+            self.log(f"{self.term_warning}Datagram not sent : {error}{self.term_endc}")
+            return False
+
+    def configure_heartbeat(self, interval=1, misses=3, max_backoff=30):
+        """
+        :param interval: time in seconds between two heartbeats, can be less than a second.
+        :param misses: number of heartbeats missed in a row before the Pi reconnects.
+        :param max_backoff: maximum time in seconds between two reconnection attempts.
+        """
+        self.heartbeat_interval = interval
+        self.heartbeat_misses = misses
+        self.reconnect_max_backoff = max_backoff
+        self.log(f"Heartbeat every {interval} s, reconnecting after {misses} missed")
+
+    def start_heartbeat(self):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+
+        self.heartbeat = Heartbeat(self.ping_server, self.reconnect, self.heartbeat_interval, self.heartbeat_misses,
+                                   self.reconnect_max_backoff, self.log, on_recovered=self.restart_session)
+        self.heartbeat.start()
+
+    def ping_server(self, timeout):
+        if self.verbose:
+            start = time()
+
+        content = dumps({"code": self.code, "request": {"type": "ping"}})
+        try:
+            r = self.post(content, timeout=timeout)
+        except Exception:
+            self.log(f"{self.term_fail}[PING] no answer{self.term_endc}")
+            return False
+
+        if r.status_code == codes.forbidden:
+            self.log(f"{self.term_fail}[PING] refused by the driver{self.term_endc}")
+            return False
+
+        if self.verbose:
+            self.log(f"[PING] {self.term_ok_green}{str(time() - start)} s{self.term_endc}\n")
+        return True
+
+    def reconnect(self, timeout):
+        """
+        Called by the heartbeat while the connection is lost.
+        """
+        if self.heartbeat.outage_started is not None and self.pairing_server is None:
+            self.log(f"{self.term_fail}[FAIL] Restarting connection procedure{self.term_endc}")
+            self.reset_session()
+            Thread(name='Connection Blink LED', target=self.show_connection).start()
+
+        self.discover_driver(min(1, timeout))
+        return self.recover_connection(timeout)
+
+    def restart_session(self):
+        """
+        Called by the heartbeat once it is connected again, so the inventory and the replayed events aren't held back.
+        """
+        self.start_session()
+        self.replay_offline()
+
+    def connection_state(self):
+        if self.heartbeat is None:
+            return CONNECTED
+        return self.heartbeat.state
+
+    def report_answer(self, answered):
+        if self.heartbeat is not None:
+            self.heartbeat.report(answered)
 
     def show_connection(self):
         if self.display_info:
@@ -40,40 +311,167 @@ class Mixin:
 
     def show_success(self):
         if self.display_info:
-            self.success_led.on()
-            sleep(0.1)
-            self.success_led.off()
-            sleep(0.1)
-            self.success_led.on()
-            sleep(0.1)
-            self.success_led.off()
+            self.success_led.blink(on_time=0.1, off_time=0.1, n=2, background=True)
 
     def show_error(self):
         if self.display_info:
-            self.error_led.on()
-            sleep(0.1)
-            self.error_led.off()
-            sleep(0.1)
-            self.error_led.on()
-            sleep(0.1)
-            self.error_led.off()
+            self.error_led.blink(on_time=0.1, off_time=0.1, n=2, background=True)
 
+    def configure_event_queue(self, max_size=256, policy="drop_oldest", workers=1):
+        """
+        Configure the queue between the input readers and the sender workers.
+        Call it before adding devices, otherwise a default queue is created on the first event.
 
-    def send_data(self, data):
-        r = Thread(name='Request', target=self.send_request, args=[data])
-        r.start()
+        :param max_size: maximum number of events waiting per worker.
+        :param policy: "block", "drop_oldest" or "drop_newest" when the queue is full.
+        :param workers: number of sender workers, events of one device always go through the same worker.
+        """
+        with self.event_queue_lock:
+            if self.event_queue is not None:
+                print(f"{self.term_warning}Event queue already running, configuration ignored.{self.term_endc}")
+                return
 
-    def send_request(self, data):
-        if not self.ready:
-            self.log(f"{self.term_fail}Error. Request not sent : program not ready.{self.term_endc}")
-            t = Thread(name='Blink LED', target=self.show_error)
-            t.start()
+            self.event_queue = EventQueue(max_size, policy, workers)
+
+            for index in range(workers):
+                worker = Thread(name=f"Sender {index}", target=self.sender_worker, args=[index], daemon=True)
+                worker.start()
+
+        self.log(f"Event queue : {max_size} events, policy {policy}, {workers} worker(s)")
+
+    def configure_batching(self, max_size=32, window=0.003):
+        """
+        Continuous events (mouse motion, scroll, axes, ADC) are grouped and sent in one request to /action/batch.
+        Discrete events like buttons and keys are never delayed.
+
+        :param max_size: a batch is sent as soon as it holds this many events, 1 disables batching.
+        :param window: maximum time in seconds an event waits for others before the batch is sent.
+        """
+        self.batch_size = max_size
+        self.batch_window = window
+        self.log(f"Batching : {max_size} events or {window * 1000} ms")
+
+    def sender_worker(self, index):
+        batch = []
+        deadline = 0
+
+        while True:
+            if batch:
+                timeout = max(0, deadline - monotonic())
+            else:
+                timeout = None
+
+            try:
+                item = self.event_queue.get(index, timeout)
+            except Empty:
+                self.flush_batch(batch)
+                batch = []
+                continue
+
+            if item[1] and self.batch_size > 1:  # continuous
+                if not batch:
+                    deadline = monotonic() + self.batch_window
+                batch.append(item)
+
+                if len(batch) >= self.batch_size:
+                    self.flush_batch(batch)
+                    batch = []
+                continue
+
+            self.flush_batch(batch)  # events already waiting must be sent first to keep order
+            batch = []
+            self.flush_batch([item])
+
+    def flush_batch(self, batch):
+        """
+        :param batch: list of (data, continuous, sampled) from the event queue.
+        """
+        if not batch:
             return
 
-        if self.verbose:
-            start = time()
-        else:
-            start = 0
+        if self.offline_buffer.pending() and self.ready and self.connection_state() != RECONNECTING:
+            self.replay_offline()  # events kept during the outage go first
+
+        try:
+            if len(batch) == 1:
+                sent = self.send_request(batch[0][0])
+            else:
+                sent = self.send_request({"code": self.code, "requests": [item[0]["request"] for item in batch]}, self.server_url + "/batch")
+        except Exception as error:
+            print(f"{self.term_fail}{error}{self.term_endc}")
+            return
+
+        if not sent:
+            self.buffer_offline(batch)
+
+    def configure_offline_buffer(self, max_size=512, ttl=10):
+        """
+        Events that can't be sent while the driver is unreachable are kept and replayed once it's back.
+
+        :param max_size: maximum number of discrete events (buttons, keys) kept, the oldest are dropped first.
+        :param ttl: time in seconds after which a discrete event is no longer replayed.
+        """
+        self.offline_buffer = OfflineBuffer(max_size, ttl)
+        self.log(f"Offline buffer : {max_size} events, {ttl} s")
+
+    def buffer_offline(self, batch):
+        for data, continuous, sampled in batch:
+            request = data.get("request")
+            if request is None or "t" not in request:
+                continue  # only input events are kept, control requests are sent again by start_session
+
+            if continuous and not sampled:
+                continue  # a late mouse motion would move the pointer unexpectedly
+
+            self.offline_buffer.add(request, sampled)
+
+        self.log(f"{self.term_warning}Kept for later : {self.offline_buffer.pending()} event(s){self.term_endc}")
+
+    def replay_offline(self):
+        """
+        Send the events kept during the outage through the batch path, in order.
+        """
+        with self.replay_lock:
+            entries = self.offline_buffer.drain()
+            if not entries:
+                return
+
+            self.log(f"{self.term_ok_green}Replaying {len(entries)} event(s){self.term_endc}")
+            size = max(self.batch_size, 32)
+            for start in range(0, len(entries), size):
+                chunk = [request for _, request, _ in entries[start:start + size]]
+                try:
+                    sent = self.send_request({"code": self.code, "requests": chunk}, self.server_url + "/batch", replay=True)
+                except Exception as error:
+                    print(f"{self.term_fail}{error}{self.term_endc}")
+                    sent = False
+
+                if not sent:
+                    self.offline_buffer.requeue(entries[start:])
+                    return
+
+    def offline_stats(self):
+        return self.offline_buffer.stats()
+
+    def queue_stats(self):
+        if self.event_queue is None:
+            return {}
+        return self.event_queue.stats()
+
+    def send_data(self, data, continuous=False, sampled=False, captured=None):
+        """
+        Queue an event for the driver.
+
+        :param data: (device type, id, event type, value) or an already built request.
+        :param continuous: True for streams where events can be grouped (motion, axes, ADC).
+        :param sampled: True if only the newest value matters (axes, ADC), it can then be sent over UDP.
+        :param captured: time.time() when the input happened (evdev timestamp), now if not given.
+        """
+        if captured is None:
+            captured = time()
+
+        if self.event_queue is None:
+            self.configure_event_queue()
 
         if type(data) != dict:
 
@@ -82,27 +480,66 @@ class Mixin:
                         {"type": data[0],
                          "id": data[1],
                          "event_type": data[2],
-                         "value": data[3]}
+                         "value": data[3],
+                         "t": captured}
                     }
+            key = (data["request"]["type"], data["request"]["id"])
 
-        content = dumps(data)
+            if sampled and self.send_datagram(data["request"]):
+                return
+        else:
+            key = "control"
+
+        if not self.event_queue.put(key, (data, continuous, sampled)):
+            self.log(f"{self.term_warning}Event dropped, queue full ({self.event_queue.dropped} dropped){self.term_endc}")
+
+    def send_request(self, data, url=None, replay=False):
+        """
+        :param replay: True when sending events kept during an outage, the connection state isn't checked.
+        :return: False if the event couldn't be sent because the driver is unreachable or refused the session (403),
+                 it can be sent again later.
+        """
+        if not self.ready:
+            self.log(f"{self.term_fail}Error. Request not sent : program not ready.{self.term_endc}")
+            self.show_error()
+            return False
+
+        if not replay and self.connection_state() == RECONNECTING:
+            self.log(f"{self.term_fail}Error. Request not sent : reconnecting to the driver.{self.term_endc}")
+            self.show_error()
+            return False
+
+        if self.verbose:
+            start = time()
+        else:
+            start = 0
+
+        data["code"] = self.code
 
         try:
-            r = post(self.server_url, data=content, headers=self.request_headers, verify=False)
+            content, url, headers = self.encode_request(data, url)
+
+            if self.send_stream(content):
+                self.log(f"Streamed. at {self.term_bold}{datetime.datetime.now().time()}{self.term_endc}")
+                self.show_success()
+                return True
+
+            r = self.post(content, url, headers)
         except Exception as error:
+            self.report_answer(False)
             print(f"{self.term_fail}{error}{self.term_endc}")
             print(f"{self.term_fail}Server not responding, driver might have stopped or encountered error{self.term_endc}")
             self.log(f"{self.term_fail}Error. at {self.term_bold}{datetime.datetime.now().time()}{self.term_endc}")
-            error_LED_thread = Thread(name='Blink LED', target=self.show_error)
-            error_LED_thread.start()
-            return
+            self.show_error()
+            return False
 
+        self.report_answer(r.status_code != codes.forbidden)  # a busy driver still answers
         if r.status_code == codes.ok:
             self.log(f"Sent. at {self.term_bold}{datetime.datetime.now().time()}{self.term_endc}")
-            info_LED_thread = Thread(name='Blink LED', target=self.show_success)
+            self.show_success()
         else:
             self.log(f"{self.term_fail}Error. at {self.term_bold}{datetime.datetime.now().time()}{self.term_endc}")
-            info_LED_thread = Thread(name='Blink LED', target=self.show_error)
+            self.show_error()
 
         self.log(f"Answered in {str(time() - start)} at {self.term_bold}{datetime.datetime.now().time()}{self.term_endc}\n")
-        info_LED_thread.start()
+        return r.status_code != codes.forbidden  # e.g. the driver restarted with a new code, kept until the session is back
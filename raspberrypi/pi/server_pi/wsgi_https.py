@@ -1,24 +1,80 @@
 from raspimote_https.wsgi import Server as WSGIServer, PathInfoDispatcher as WSGIPathInfoDispatcher
 from raspimote_https.ssl.builtin import BuiltinSSLAdapter
 from sys import argv
+from os import path
+from threading import Thread
+import ssl
 
-from connect_server import app
+try:
+    from .connect_server import app, paired, pairing
+except ImportError:  # started as a script
+    from connect_server import app, paired, pairing
 
 
-if "-verbose" in argv or "-v" in argv:
-    verbose = True
-else:
-    verbose = False
+# Server tuning, copied from driver/driver/lan_server/wsgi_https.py (the reference, the driver isn't installed on the Pi)
+TLS_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"  # TLS 1.2 suites, forward secrecy and AEAD only (TLS 1.3 suites are always fast)
+TLS_TICKETS = 2  # session tickets sent after each TLS 1.3 handshake
+KEEP_ALIVE_TIMEOUT = 30  # seconds an idle connection is kept open
+MIN_THREADS = 1  # only used while pairing
+MAX_THREADS = 4
 
-my_app = WSGIPathInfoDispatcher({'/': app}, verbose=verbose)
-server = WSGIServer(('0.0.0.0', 9876), my_app, verbose=verbose)
 
-ssl_cert = "cert.pem"
-ssl_key = "key.key"
-server.ssl_adapter =  BuiltinSSLAdapter(ssl_cert, ssl_key, verbose=verbose)
+def tune_tls(context):
+    """
+    Same as tune_tls in driver/driver/lan_server/wsgi_https.py.
+    """
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.options &= ~ssl.OP_NO_TICKET
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE
+    if hasattr(context, "num_tickets"):
+        context.num_tickets = TLS_TICKETS
+
+
+class PairingServer:
+    def __init__(self, port=9876, verbose=False):
+        """
+        Pairing server running in the Pi's process, started when a driver has to connect and stopped just after.
+        """
+        self.port = port
+        self.verbose = verbose
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        paired.clear()
+
+        folder = path.dirname(path.abspath(__file__))
+        my_app = WSGIPathInfoDispatcher({'/': app}, verbose=self.verbose)
+        self.server = WSGIServer(('0.0.0.0', self.port), my_app, numthreads=MIN_THREADS, max=MAX_THREADS,
+                                 timeout=KEEP_ALIVE_TIMEOUT, verbose=self.verbose)
+        self.server.ssl_adapter = BuiltinSSLAdapter(path.join(folder, "cert.pem"), path.join(folder, "key.key"), verbose=self.verbose)
+        tune_tls(self.server.ssl_adapter.context)
+
+        self.thread = Thread(name="Pairing server", target=self.server.start, kwargs={"verbose": self.verbose}, daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout=None):
+        """
+        :return: {"ip", "code", "key", "platform"} sent by the driver, None if it didn't connect before the timeout.
+        """
+        if not paired.wait(timeout):
+            return None
+        return dict(pairing)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
 
 if __name__ == '__main__':
-   try:
-      server.start(verbose=verbose)
-   except KeyboardInterrupt:
-      server.stop()
\ No newline at end of file
+    pairing_server = PairingServer(verbose="-verbose" in argv or "-v" in argv)
+    pairing_server.start()
+    try:
+        print(pairing_server.wait())
+    except KeyboardInterrupt:
+        pass
+    pairing_server.stop()
@@ -0,0 +1,124 @@
+"""
+Client side of the persistent TLS channel to the driver (see driver/driver/lan_server/stream_server.py).
+Frames are a 4 bytes big-endian length followed by the payload, the driver acknowledges them periodically
+and tells how many of them it rejected (malformed, or refused because it was busy).
+"""
+import socket
+import ssl
+from struct import Struct
+from json import dumps, loads
+from threading import Lock, Thread
+
+LENGTH = Struct(">I")
+
+
+class StreamChannel:
+    def __init__(self, host, port, code, log=print):
+        self.host = host
+        self.port = port
+        self.code = code
+        self.log = log
+
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+        self.tls_session = None  # kept to resume the TLS session after a reconnection
+
+        self.socket = None
+        self.write_lock = Lock()
+
+        self.sent = 0
+        self.acked = 0
+        self.rejected = 0
+        self.lost = 0
+
+    def connected(self):
+        return self.socket is not None
+
+    def connect(self, timeout=3):
+        raw = socket.create_connection((self.host, self.port), timeout=timeout)
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = self.context.wrap_socket(raw, session=self.tls_session)
+
+        self.write(connection, dumps({"code": self.code}).encode())
+        answer = loads(self.read(connection))
+        if "ack" not in answer:
+            connection.close()
+            raise ConnectionError(answer.get("error", "Stream refused"))
+
+        connection.settimeout(None)
+        self.tls_session = connection.session
+        self.sent = 0
+        self.acked = 0
+        self.rejected = 0
+        self.socket = connection
+
+        reader = Thread(name="Stream Acknowledgements", target=self.read_acks, args=[connection], daemon=True)
+        reader.start()
+        self.log(f"Stream opened (TLS session reused : {connection.session_reused})")
+
+    def close(self):
+        with self.write_lock:
+            if self.socket is None:
+                return
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+
+        if self.sent > self.acked:
+            self.lost += self.sent - self.acked
+            self.log(f"Stream closed with {self.sent - self.acked} frame(s) not acknowledged")
+
+    def send(self, payload):
+        """
+        :param payload: bytes, a JSON document or a binary wire frame.
+        :raise ConnectionError: the stream is closed, the caller must use another transport.
+        """
+        with self.write_lock:
+            if self.socket is None:
+                raise ConnectionError("Stream not connected")
+            try:
+                self.write(self.socket, payload)
+            except OSError as error:
+                raise ConnectionError(error)
+            self.sent += 1
+
+    def read_acks(self, connection):
+        try:
+            while True:
+                answer = loads(self.read(connection))
+                if "ack" in answer:
+                    if answer.get("rejected", 0) > self.rejected:
+                        self.log(f"{answer['rejected'] - self.rejected} stream frame(s) rejected by the driver")
+                    self.acked = answer["ack"]
+                    self.rejected = answer.get("rejected", 0)
+        except (OSError, ValueError):
+            pass
+
+        if connection is self.socket:
+            self.close()
+
+    def stats(self):
+        return {"sent": self.sent, "acked": self.acked, "rejected": self.rejected, "unacked": self.sent - self.acked,
+                "lost": self.lost}
+
+    @staticmethod
+    def write(connection, payload):
+        connection.sendall(LENGTH.pack(len(payload)) + payload)
+
+    @staticmethod
+    def read(connection):
+        size = LENGTH.unpack(StreamChannel.read_exactly(connection, LENGTH.size))[0]
+        return StreamChannel.read_exactly(connection, size)
+
+    @staticmethod
+    def read_exactly(connection, size):
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Stream closed")
+            data += chunk
+        return data
@@ -0,0 +1,98 @@
+"""
+Compact binary format for input events.
+
+A frame is a header followed by fixed size events :
+    header : magic (B), version (B), connection code (I), number of events (H)
+    event  : device type (B), device id (H), event type (H), value kind (B), value (d), second value (d), capture time (d)
+
+Device types, device ids and event types are sent as indexes in name tables.
+The tables are sent to the driver in JSON (/action/wire) the first time a name is used.
+"""
+from struct import Struct
+from threading import Lock
+
+MAGIC = 0xA5
+VERSION = 2
+
+HEADER = Struct("<BBIH")
+EVENT = Struct("<BHHBddd")
+
+VALUE_INT = 0
+VALUE_FLOAT = 1
+VALUE_PAIR = 2
+
+TABLES = ("types", "ids", "events")
+
+
+class WireEncoder:
+    def __init__(self):
+        self.tables = {table: [] for table in TABLES}
+        self.indexes = {table: {} for table in TABLES}
+        self.lock = Lock()
+
+    def intern(self, table, value, update):
+        key = (type(value), value)
+        index = self.indexes[table].get(key)
+
+        if index is None:
+            index = len(self.tables[table])
+            if index > 0xFFFF or (table == "types" and index > 0xFF):
+                raise ValueError(f"Wire table {table} is full")
+
+            self.tables[table].append(value)
+            self.indexes[table][key] = index
+            update[table]["values"].append(value)
+
+        return index
+
+    def encode(self, code, requests, send_update):
+        """
+        Build a frame from a list of requests.
+
+        :param code: connection code.
+        :param requests: list of {"type", "id", "event_type", "value"} dictionaries.
+        :param send_update: called with the new table entries, before the frame can be sent.
+        :raise ValueError: if an event can't be represented, JSON must be used for it.
+        :return: bytes
+        """
+        with self.lock:
+            update = {table: {"start": len(self.tables[table]), "values": []} for table in TABLES}
+            added = {table: len(self.tables[table]) for table in TABLES}
+
+            try:
+                body = b''.join(self.encode_event(request, update) for request in requests)
+            except ValueError:
+                self.rollback(added)
+                raise
+
+            if any(update[table]["values"] for table in TABLES):
+                try:
+                    send_update(update)
+                except Exception:
+                    self.rollback(added)
+                    raise
+
+        return HEADER.pack(MAGIC, VERSION, int(code), len(requests)) + body
+
+    def encode_event(self, request, update):
+        value = request["value"]
+
+        if type(value) == bool or type(value) == int:
+            kind, first, second = VALUE_INT, value, 0
+        elif type(value) == float:
+            kind, first, second = VALUE_FLOAT, value, 0
+        elif type(value) in (list, tuple) and len(value) == 2:
+            kind, first, second = VALUE_PAIR, value[0], value[1]
+        else:
+            raise ValueError(f"Value not supported by the binary format : {value}")
+
+        return EVENT.pack(self.intern("types", request["type"], update),
+                          self.intern("ids", request["id"], update),
+                          self.intern("events", request["event_type"], update),
+                          kind, first, second, request.get("t", 0))
+
+    def rollback(self, sizes):
+        for table in TABLES:
+            for value in self.tables[table][sizes[table]:]:
+                del self.indexes[table][(type(value), value)]
+            del self.tables[table][sizes[table]:]
@@ -0,0 +1,78 @@
+# RaspiMote
+# https://github.com/RaspiMote
+# Copyright (C) 2021 RaspiMote (@A-delta & @Firmin-Launay)
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Check that the code shared by the Pi and the driver is the same in both copies (they are installed separately).
+Docstrings are ignored. Exits with status 1 if a copy differs from its reference.
+
+    python3 check_copies.py
+"""
+import ast
+from os import path
+from sys import exit
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# (reference, copy, names compared, None for the whole module)
+COPIES = [
+    ("driver/driver/lan_server/discovery.py", "raspberrypi/pi/discovery.py", None),
+    ("driver/driver/lan_server/wsgi_https.py", "raspberrypi/pi/server_pi/wsgi_https.py",
+     ["TLS_CIPHERS", "TLS_TICKETS", "KEEP_ALIVE_TIMEOUT", "tune_tls"]),
+]
+
+
+def without_docstrings(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                node.body = node.body[1:]
+    return tree
+
+
+def definitions(file, names):
+    """
+    :return: {name: dump of its definition}, the whole module under None if names is None.
+    """
+    with open(path.join(ROOT, file), "r", encoding="utf-8") as source:
+        tree = without_docstrings(ast.parse(source.read()))
+
+    if names is None:
+        return {None: ast.dump(tree)}
+
+    found = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node.name in names:
+            found[node.name] = ast.dump(node)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in names:
+                    found[target.id] = ast.dump(node)
+    return found
+
+
+def main():
+    different = 0
+    for reference, copy, names in COPIES:
+        expected = definitions(reference, names)
+        actual = definitions(copy, names)
+        for name in (names or [None]):
+            label = f"{copy} ({name})" if name else copy
+            if name not in expected or expected.get(name) != actual.get(name):
+                print(f"{label} differs from {reference}")
+                different += 1
+
+    if different:
+        exit(1)
+    print(f"{len(COPIES)} copies checked")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# RaspiMote
+# https://github.com/RaspiMote
+# Copyright (C) 2021 RaspiMote (@A-delta & @Firmin-Launay)
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compare full and resumed TLS handshakes with the driver (or the Pi while pairing).
+
+    python3 tls_handshake_benchmark.py <host> [port] [connections] [-tls1.2]
+"""
+import socket
+import ssl
+from statistics import mean, median
+from sys import argv
+from time import perf_counter
+
+
+def handshake(context, host, port, session=None):
+    """
+    :return: (handshake time in seconds, session to resume, True if the session was resumed)
+    """
+    raw = socket.create_connection((host, port), timeout=5)
+    start = perf_counter()
+    connection = context.wrap_socket(raw, session=session)
+    elapsed = perf_counter() - start
+
+    # TLS 1.3 tickets arrive after the handshake, a request makes sure they are read
+    connection.sendall(f"GET /test HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    while connection.recv(4096):
+        pass
+
+    result = elapsed, connection.session, connection.session_reused
+    connection.close()
+    return result
+
+
+def report(name, times):
+    times = [elapsed * 1000 for elapsed in times]
+    print(f"{name:8} mean {mean(times):7.2f} ms   median {median(times):7.2f} ms   max {max(times):7.2f} ms")
+
+
+def main():
+    if len(argv) < 2:
+        print(__doc__)
+        return
+
+    options = [arg for arg in argv[1:] if arg.startswith("-")]
+    args = [arg for arg in argv[1:] if not arg.startswith("-")]
+    host = args[0]
+    port = int(args[1]) if len(args) > 1 else 9876
+    connections = int(args[2]) if len(args) > 2 else 50
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    if "-tls1.2" in options:
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    full = [handshake(context, host, port)[0] for _ in range(connections)]
+
+    resumed = []
+    reused = 0
+    session = handshake(context, host, port)[1]
+    for _ in range(connections):
+        elapsed, new_session, session_reused = handshake(context, host, port, session)
+        resumed.append(elapsed)
+        reused += session_reused
+        session = new_session or session
+
+    report("full", full)
+    report("resumed", resumed)
+    print(f"{reused}/{connections} sessions resumed, resumed handshake takes {mean(resumed) / mean(full):.0%} of a full one")
+
+
+if __name__ == "__main__":
+    main()